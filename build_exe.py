@@ -9,6 +9,7 @@ import os
 import sys
 import subprocess
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 def check_pyinstaller():
@@ -33,18 +34,26 @@ def install_pyinstaller():
         return False
 
 def clean_build_dirs():
-    """清理之前的构建目录"""
-    dirs_to_clean = ['build', 'dist', '__pycache__']
-    for dir_name in dirs_to_clean:
-        if os.path.exists(dir_name):
-            print(f"🧹 清理目录: {dir_name}")
-            shutil.rmtree(dir_name)
-    
-    # 清理.spec文件
+    """清理之前的构建目录（多个目录并行删除）"""
+    dirs_to_clean = [Path(name) for name in ('build', 'dist', '__pycache__')]
     spec_files = list(Path('.').glob('*.spec'))
-    for spec_file in spec_files:
-        print(f"🧹 清理文件: {spec_file}")
-        spec_file.unlink()
+    
+    with ThreadPoolExecutor(max_workers=len(dirs_to_clean)) as executor:
+        futures = {}
+        for dir_path in dirs_to_clean:
+            if dir_path.exists():
+                print(f"🧹 清理目录: {dir_path}")
+                futures[executor.submit(shutil.rmtree, dir_path)] = dir_path
+        # 清理.spec文件
+        for spec_file in spec_files:
+            print(f"🧹 清理文件: {spec_file}")
+            futures[executor.submit(spec_file.unlink)] = spec_file
+        
+        for future, path in futures.items():
+            try:
+                future.result()
+            except OSError as e:
+                print(f"⚠️ 清理失败 {path}: {e}")
 
 def create_version_info():
     """创建版本信息文件"""
@@ -105,7 +114,8 @@ def build_executable():
     # PyInstaller命令参数
     cmd = [
         'pyinstaller',
-        '--onefile',                    # 打包成单个文件
+        '--onedir',                     # 打包成目录，启动时无需解压到临时目录
+        '--noupx',                      # 不使用UPX压缩，加快加载
         '--windowed',                   # 不显示控制台窗口
         '--name=MultiScannerApp',       # 可执行文件名称
         '--icon=scanner.ico',           # 图标文件（如果存在）
@@ -115,6 +125,7 @@ def build_executable():
         '--hidden-import=serial.tools.list_ports',
         '--hidden-import=winsound',
         '--hidden-import=winreg',
+        '--exclude-module=matplotlib',  # 未使用的大型库，减小包体积
         '--clean',                      # 清理临时文件
         'multi_scanner.py'              # 主程序文件
     ]
@@ -135,10 +146,10 @@ def build_executable():
         return False
 
 def copy_additional_files():
-    """复制额外的文件到dist目录"""
-    dist_dir = Path('dist')
+    """复制额外的文件到程序目录"""
+    dist_dir = Path('dist') / 'MultiScannerApp'
     if not dist_dir.exists():
-        print("❌ dist目录不存在")
+        print(f"❌ 程序目录不存在: {dist_dir}")
         return
     
     # 需要复制的文件
@@ -148,9 +159,17 @@ def copy_additional_files():
         'database_setup.sql'
     ]
     
-    for file_name in files_to_copy:
-        if os.path.exists(file_name):
-            shutil.copy2(file_name, dist_dir)
+    # 一次扫描当前目录得到已存在的文件，再并行复制
+    with os.scandir('.') as entries:
+        present = {entry.name for entry in entries if entry.is_file()}
+    to_copy = [name for name in files_to_copy if name in present]
+    
+    def copy_one(file_name):
+        shutil.copyfile(file_name, dist_dir / file_name)
+        return file_name
+    
+    with ThreadPoolExecutor(max_workers=max(len(to_copy), 1)) as executor:
+        for file_name in executor.map(copy_one, to_copy):
             print(f"📋 已复制: {file_name}")
     
     # 创建README文件
@@ -159,7 +178,7 @@ def copy_additional_files():
 ========================
 
 使用说明：
-1. 双击 MultiScannerApp.exe 启动程序
+1. 双击 MultiScannerApp.exe 启动程序（请保留同目录下的 _internal 等文件）
 2. 首次运行时，请确保.env文件中的数据库配置正确
 3. 程序会自动检测可用的串口设备
 4. 支持多设备同时扫描和数据管理
@@ -204,8 +223,8 @@ def main():
     
     print("\n" + "=" * 50)
     print("✅ 打包完成！")
-    print(f"📁 可执行文件位置: {os.path.abspath('dist')}")
-    print("🎉 您可以在dist目录中找到MultiScannerApp.exe")
+    print(f"📁 程序目录位置: {os.path.abspath(os.path.join('dist', 'MultiScannerApp'))}")
+    print("🎉 发布时请分发整个 dist/MultiScannerApp 目录")
     
     return True
 
@@ -1,43 +1,44 @@
 """
 检查数据库中的实际数据
 """
-import os
-import requests
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-
-# 加载环境变量
-load_dotenv()
+from supabase_session import SESSION, API_URL, DEFAULT_TIMEOUT, config_complete
 
 def check_database_data():
     """检查数据库中的数据"""
     print("🔍 检查数据库中的实际数据...")
     
-    # 获取配置
-    supabase_url = os.getenv('SUPABASE_URL')
-    supabase_key = os.getenv('SUPABASE_KEY')
-    
-    if not supabase_url or not supabase_key:
-        print("❌ 数据库配置不完整")
+    if not config_complete():
         return False
     
-    # 构建API端点
-    api_url = f"{supabase_url}/rest/v1"
-    headers = {
-        'apikey': supabase_key,
-        'Authorization': f'Bearer {supabase_key}',
-        'Content-Type': 'application/json'
-    }
+    today = datetime.now().strftime('%Y-%m-%d')
     
     try:
+        # 三个查询互不依赖，并发发出，结果按原顺序输出
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            latest_future = executor.submit(
+                SESSION.get,
+                f"{API_URL}/barcode_scans?limit=5&order=scan_time.desc",
+                timeout=DEFAULT_TIMEOUT
+            )
+            count_future = executor.submit(
+                SESSION.get,
+                f"{API_URL}/barcode_scans?select=count",
+                headers={'Prefer': 'count=exact'},
+                timeout=DEFAULT_TIMEOUT
+            )
+            today_future = executor.submit(
+                SESSION.get,
+                f"{API_URL}/barcode_scans?scan_time=gte.{today}T00:00:00&order=scan_time.desc",
+                timeout=DEFAULT_TIMEOUT
+            )
+            response = latest_future.result()
+            count_response = count_future.result()
+            today_response = today_future.result()
+        
         # 1. 检查表是否存在
         print("\n📋 检查 barcode_scans 表...")
-        response = requests.get(
-            f"{api_url}/barcode_scans?limit=5&order=scan_time.desc",
-            headers=headers,
-            timeout=10
-        )
-        
         print(f"📊 HTTP状态码: {response.status_code}")
         
         if response.status_code == 200:
@@ -64,11 +65,6 @@ def check_database_data():
             
         # 2. 检查总记录数
         print("\n📊 检查总记录数...")
-        count_response = requests.get(
-            f"{api_url}/barcode_scans?select=count",
-            headers={**headers, 'Prefer': 'count=exact'},
-            timeout=10
-        )
         
         if count_response.status_code == 200:
             count_header = count_response.headers.get('Content-Range', '')
@@ -80,12 +76,6 @@ def check_database_data():
         
         # 3. 检查今天的记录
         print("\n📅 检查今天的记录...")
-        today = datetime.now().strftime('%Y-%m-%d')
-        today_response = requests.get(
-            f"{api_url}/barcode_scans?scan_time=gte.{today}T00:00:00&order=scan_time.desc",
-            headers=headers,
-            timeout=10
-        )
         
         if today_response.status_code == 200:
             today_data = today_response.json()
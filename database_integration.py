@@ -4,8 +4,17 @@
 """
 
 import json
+import importlib.util
+import functools
 import uuid
 import os
+import time
+import queue
+import atexit
+import threading
+import sqlite3
+from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional, Dict, List, Any
 import logging
@@ -19,16 +28,112 @@ except ImportError:
     DOTENV_AVAILABLE = False
     print("提示: python-dotenv 库未安装，将直接使用系统环境变量。运行: pip install python-dotenv")
 
-# 尝试导入supabase，如果失败则使用离线模式
-try:
-    from supabase import create_client, Client
-    SUPABASE_AVAILABLE = True
-except Exception as e:
-    SUPABASE_AVAILABLE = False
-    print(f"警告: supabase 库导入失败: {e}")
+@functools.lru_cache(maxsize=None)
+def _env_bool(name: str, default: str = 'true') -> bool:
+    """读取布尔型环境变量（结果缓存，重新加载配置时需调用 _env_bool.cache_clear()）"""
+    return os.getenv(name, default).lower() == 'true'
+
+# supabase 及其依赖较重，只在初始化客户端时才导入；这里仅检查是否已安装
+SUPABASE_AVAILABLE = importlib.util.find_spec('supabase') is not None
+if not SUPABASE_AVAILABLE:
+    print("警告: 未安装 supabase 库")
     print("程序将以离线模式运行")
-    # 创建一个虚拟的Client类型提示
-    Client = None
+create_client = None
+APIError = None
+
+def _import_supabase() -> bool:
+    """按需导入 supabase，导入失败时切换到离线模式"""
+    global SUPABASE_AVAILABLE, create_client, APIError
+    if create_client is not None:
+        return True
+    if not SUPABASE_AVAILABLE:
+        return False
+    try:
+        from supabase import create_client
+        from postgrest.exceptions import APIError
+    except Exception as e:
+        SUPABASE_AVAILABLE = False
+        print(f"警告: supabase 库导入失败: {e}")
+        print("程序将以离线模式运行")
+        return False
+    return True
+
+# 优先使用 orjson 加速 JSON 序列化，未安装时退回标准库
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+def _dumps(obj) -> bytes:
+    """把对象序列化为 JSON（UTF-8 字节）"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+def _loads(data):
+    """解析 JSON 文本或字节"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# 扫描时间字符串缓存 (时间戳, ISO 字符串)，1 毫秒内的连续扫描复用同一个值
+_now_cache = (0.0, '')
+
+def _iso_now() -> str:
+    """返回当前时间的 ISO 字符串，按毫秒缓存以减少突发扫描时的重复格式化"""
+    global _now_cache
+    now = time.time()
+    cached_t, cached_s = _now_cache
+    if now - cached_t > 0.001 or not cached_s:
+        cached_s = datetime.fromtimestamp(now).isoformat()
+        _now_cache = (now, cached_s)
+    return cached_s
+
+def _scan_time_ms(scan_time: str) -> int:
+    """把 ISO 扫描时间转换为毫秒时间戳（无时区的时间按本地时间处理），无法解析时使用当前时间"""
+    try:
+        return int(datetime.fromisoformat(scan_time).timestamp() * 1000)
+    except (TypeError, ValueError):
+        return int(time.time() * 1000)
+
+# 批量上传时每个请求包含的最大记录数
+UPLOAD_BATCH_SIZE = 500
+
+# 后台上传线程每批最多合并的扫描数，以及凑批的最长等待时间（秒）
+QUEUE_BATCH_SIZE = 100
+QUEUE_FLUSH_INTERVAL = 0.1
+
+# 本地备份库文件名及其所在子目录（位于本地数据目录下，与 HTTP 后端的 JSONL 备份文件分开存放）
+LOCAL_DB_FILENAME = 'scans.db'
+LOCAL_DB_SUBDIR = 'sqlite'
+
+# 本地库 synced 列取值：待上传 / 已上传 / 被服务器拒绝（不再重试）
+SYNC_PENDING = 0
+SYNC_DONE = 1
+SYNC_REJECTED = -1
+
+# 旧版 JSONL 备份的同步位置文件和失败记录文件后缀（仅用于导入旧数据）
+SYNC_CURSOR_FILENAME = '.sync_cursor.json'
+FAILED_SUFFIX = '.failed.jsonl'
+
+# HTTP 后端（database_integration_http）的同步账本后缀和同步进度文件，需与该模块保持一致；
+# 有账本或同步进度的 scans_*.jsonl 由 HTTP 后端管理，不作为旧版备份导入
+HTTP_LEDGER_SUFFIX = '.synced'
+HTTP_SYNC_OFFSETS_FILENAME = '.offsets.json'
+
+# 更早版本的 JSON 数组备份文件（保存上传失败的记录，可由 LOCAL_BACKUP_FILENAME 指定，仅用于导入旧数据）
+LEGACY_BACKUP_FILENAME = 'local_scan_backup.json'
+
+@dataclass(frozen=True)
+class _Config:
+    """数据库管理器配置（初始化时从环境变量读取一次，之后只读）"""
+    __slots__ = ('database_enabled', 'local_backup_enabled', 'auto_sync_enabled', 'log_level')
+    database_enabled: bool
+    local_backup_enabled: bool
+    auto_sync_enabled: bool
+    log_level: str
+
 
 class DatabaseManager:
     """数据库管理器"""
@@ -45,23 +150,29 @@ class DatabaseManager:
         self.supabase_url = supabase_url or os.getenv('SUPABASE_URL')
         self.supabase_key = supabase_key or os.getenv('SUPABASE_KEY')
         self.client = None
+        # 直连 PostgREST 的批量插入通道（见 _init_http_insert）
+        self._http = None
         
         # 从环境变量读取配置选项
-        self.config = {
-            'database_enabled': os.getenv('DATABASE_ENABLED', 'true').lower() == 'true',
-            'local_backup_enabled': os.getenv('LOCAL_BACKUP_ENABLED', 'true').lower() == 'true',
-            'local_backup_filename': os.getenv('LOCAL_BACKUP_FILENAME', 'local_scan_backup.json'),
-            'auto_sync_enabled': os.getenv('AUTO_SYNC_ENABLED', 'true').lower() == 'true',
-            'log_level': os.getenv('LOG_LEVEL', 'INFO').upper()
-        }
+        self.config = _Config(
+            database_enabled=_env_bool('DATABASE_ENABLED'),
+            local_backup_enabled=_env_bool('LOCAL_BACKUP_ENABLED'),
+            auto_sync_enabled=_env_bool('AUTO_SYNC_ENABLED'),
+            log_level=os.getenv('LOG_LEVEL', 'INFO').upper()
+        )
         
         # 设置本地数据目录
         self.local_data_dir = os.getenv('LOCAL_DATA_DIR', 'local_data')
+        # 本地备份库连接（首次使用时打开），扫描线程和后台上传线程共用
+        self._local_db = None
+        self._local_lock = threading.RLock()
         
         # 设置日志
-        log_level = getattr(logging, self.config['log_level'], logging.INFO)
-        logging.basicConfig(level=log_level)
+        # 日志级别只作用于本模块的 logger，不再修改全局 root logger 的级别
+        log_level = getattr(logging, self.config.log_level, logging.INFO)
+        logging.basicConfig()
         self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
         
         # 显示配置信息
         if not SUPABASE_AVAILABLE:
@@ -71,22 +182,56 @@ class DatabaseManager:
         else:
             self.logger.warning("未找到数据库配置，将使用离线模式")
         
-        if SUPABASE_AVAILABLE and self.supabase_url and self.supabase_key and self.config['database_enabled']:
+        if SUPABASE_AVAILABLE and self.supabase_url and self.supabase_key and self.config.database_enabled:
             self._initialize_client()
+        
+        # 扫描上传队列：扫描线程只负责入队，由后台线程批量写入数据库
+        self._queue = queue.Queue()
+        threading.Thread(target=self._flush_loop, daemon=True).start()
     
     def _initialize_client(self):
         """初始化 Supabase 客户端"""
-        if not SUPABASE_AVAILABLE:
+        if not _import_supabase():
             self.logger.warning("Supabase库不可用，无法初始化客户端")
             return
             
         try:
             self.client = create_client(self.supabase_url, self.supabase_key)
             self.logger.info("Supabase 客户端初始化成功")
+            self._init_http_insert()
         except Exception as e:
             self.logger.error(f"Supabase 客户端初始化失败: {e}")
             self.client = None
     
+    def _init_http_insert(self):
+        """
+        预先构建插入地址和请求头，并创建复用连接的 httpx 客户端
+        
+        后台批量上传直接 POST 到 PostgREST，绕过 supabase-py 每次请求的封装开销；
+        httpx 不可用时继续使用 supabase 客户端。
+        """
+        if self._http is not None:
+            self._http.close()
+            self._http = None
+        
+        try:
+            import httpx
+        except ImportError:
+            return
+        
+        self._insert_url = f"{self.supabase_url.rstrip('/')}/rest/v1/barcode_scans"
+        self._insert_headers = {
+            'apikey': self.supabase_key,
+            'Authorization': f'Bearer {self.supabase_key}',
+            'Content-Type': 'application/json',
+            'Prefer': 'return=minimal'
+        }
+        try:
+            self._http = httpx.Client(http2=True, headers=self._insert_headers, timeout=10)
+        except ImportError:
+            # 未安装 h2 时使用 HTTP/1.1
+            self._http = httpx.Client(headers=self._insert_headers, timeout=10)
+    
     def configure_database(self, supabase_url: str, supabase_key: str):
         """配置数据库连接"""
         self.supabase_url = supabase_url
@@ -98,7 +243,27 @@ class DatabaseManager:
     
     def upload_scan_data(self, barcode_data: str, device_port: str) -> bool:
         """
-        上传扫描数据
+        上传扫描数据（异步）
+        
+        数据库可用时只把扫描放入上传队列并立即返回，由后台线程批量上传；
+        数据库不可用时直接保存到本地。
+        
+        Args:
+            barcode_data: 条码数据
+            device_port: 设备端口
+            
+        Returns:
+            数据是否已入队或保存
+        """
+        if not SUPABASE_AVAILABLE or not self.client or not self.config.database_enabled:
+            return self.upload_scan_data_sync(barcode_data, device_port)
+        
+        self._queue.put((barcode_data, device_port, _iso_now()))
+        return True
+    
+    def upload_scan_data_sync(self, barcode_data: str, device_port: str) -> bool:
+        """
+        同步上传单条扫描数据（阻塞直到请求完成）
         
         Args:
             barcode_data: 条码数据
@@ -108,8 +273,8 @@ class DatabaseManager:
             上传是否成功
         """
         # 如果数据库不可用或未启用，直接保存到本地
-        if not SUPABASE_AVAILABLE or not self.client or not self.config['database_enabled']:
-            if self.config['local_backup_enabled']:
+        if not SUPABASE_AVAILABLE or not self.client or not self.config.database_enabled:
+            if self.config.local_backup_enabled:
                 if not SUPABASE_AVAILABLE:
                     self.logger.warning("数据库库不可用，数据将保存到本地")
                 else:
@@ -123,125 +288,475 @@ class DatabaseManager:
             scan_data = {
                 'barcode_data': barcode_data,
                 'device_port': device_port,
-                'scan_time': datetime.now().isoformat()
+                'scan_time': _iso_now()
             }
             
-            self.logger.debug(f"尝试上传扫描数据: {scan_data}")
+            self.logger.debug("尝试上传扫描数据: %s", scan_data)
             response = self.client.table('barcode_scans').insert(scan_data).execute()
             
             if response.data:
-                self.logger.info(f"扫描数据上传成功: {barcode_data}")
+                self.logger.info("扫描数据上传成功: %s", barcode_data)
                 # 同时保存到本地备份（如果启用）
-                if self.config['local_backup_enabled']:
-                    self._save_to_local(barcode_data, device_port)
+                if self.config.local_backup_enabled:
+                    self._save_to_local(barcode_data, device_port, synced=True)
                 return True
             else:
                 self.logger.error("扫描数据上传失败: 无响应数据")
                 # 上传失败时保存到本地
-                if self.config['local_backup_enabled']:
+                if self.config.local_backup_enabled:
                     return self._save_to_local(barcode_data, device_port)
                 return False
                 
         except Exception as e:
             self.logger.error(f"扫描数据上传失败: {e}")
             # 上传失败时保存到本地
-            if self.config['local_backup_enabled']:
+            if self.config.local_backup_enabled:
                 return self._save_to_local(barcode_data, device_port)
             return False
 
-    def _save_to_local(self, barcode_data: str, device_port: str) -> bool:
-        """保存数据到本地文件（备份/离线模式）"""
-        if not self.config['local_backup_enabled']:
+    def _flush_loop(self):
+        """后台上传线程：从队列凑批后一次批量插入"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + QUEUE_FLUSH_INTERVAL
+            while len(batch) < QUEUE_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            try:
+                self._flush_batch(batch)
+            except Exception as e:
+                self.logger.error(f"后台上传线程异常: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    def _flush_batch(self, batch: List[tuple]):
+        """批量上传一批排队的扫描，失败时整批转存本地"""
+        rows = [
+            {'barcode_data': barcode_data, 'device_port': device_port, 'scan_time': scan_time}
+            for barcode_data, device_port, scan_time in batch
+        ]
+        
+        try:
+            if not self.client:
+                raise RuntimeError("数据库客户端不可用")
+            if self._http is not None:
+                response = self._http.post(self._insert_url, content=_dumps(rows))
+                if not response.is_success:
+                    raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+            else:
+                response = self.client.table('barcode_scans').insert(rows).execute()
+                if not response.data:
+                    raise RuntimeError("无响应数据")
+        except Exception as e:
+            if self._save_many_to_local(batch):
+                self.logger.error(f"批量上传 {len(rows)} 条扫描数据失败，已转存本地: {e}")
+            else:
+                self.logger.error(f"批量上传 {len(rows)} 条扫描数据失败且未能保存到本地（本地备份已禁用或写入失败），数据已丢失: {e}")
+            return
+        
+        self.logger.info("批量上传扫描数据成功: %d 条", len(rows))
+        if self.config.local_backup_enabled:
+            self._save_many_to_local(batch, synced=True)
+    
+    def flush(self, timeout: float = 5.0) -> bool:
+        """
+        等待上传队列清空
+        
+        超时后仍在排队的扫描会被转存到本地，避免退出时丢失。
+        
+        Returns:
+            队列是否在超时前全部处理完成
+        """
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(0.05)
+        else:
+            return True
+        
+        pending = []
+        while True:
+            try:
+                pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if pending:
+            saved = self._save_many_to_local(pending)
+            for _ in pending:
+                self._queue.task_done()
+            if saved:
+                self.logger.warning(f"上传队列等待超时，{len(pending)} 条扫描数据已转存本地")
+            else:
+                self.logger.error(f"上传队列等待超时，{len(pending)} 条扫描数据未能保存到本地，数据已丢失")
+        return False
+
+    def _save_to_local(self, barcode_data: str, device_port: str, synced: bool = False,
+                       scan_time: str = None) -> bool:
+        """
+        保存数据到本地 SQLite 备份库（备份/离线模式）
+        
+        Args:
+            barcode_data: 条码数据
+            device_port: 设备端口
+            synced: 数据是否已上传到数据库（已上传的记录同步时会被跳过）
+            scan_time: 扫描时间（默认为当前时间）
+        """
+        return self._save_many_to_local([(barcode_data, device_port, scan_time or _iso_now())], synced)
+    
+    def _save_many_to_local(self, scans: List[tuple], synced: bool = False) -> bool:
+        """
+        在一个事务中保存多条扫描到本地备份库
+        
+        Args:
+            scans: (条码数据, 设备端口, 扫描时间) 列表
+            synced: 这些数据是否已上传到数据库
+        """
+        if not self.config.local_backup_enabled:
             return False
         
+        status = SYNC_DONE if synced else SYNC_PENDING
         try:
-            local_data = {
-                'barcode_data': barcode_data,
-                'scan_time': datetime.now().isoformat(),
-                'device_port': device_port,
-                'synced': False
-            }
-            
-            # 确保本地数据目录存在
-            os.makedirs(self.local_data_dir, exist_ok=True)
-            
-            # 生成文件名（按日期分组）
-            date_str = datetime.now().strftime('%Y-%m-%d')
-            filename = f"scans_{date_str}.jsonl"
-            filepath = os.path.join(self.local_data_dir, filename)
+            with self._local_transaction() as conn:
+                conn.executemany(
+                    'INSERT INTO scans (barcode_data, device_port, scan_time, scan_ts_ms, synced) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(barcode_data, device_port, scan_time, _scan_time_ms(scan_time), status)
+                     for barcode_data, device_port, scan_time in scans]
+                )
             
-            # 追加写入文件
-            with open(filepath, 'a', encoding='utf-8') as f:
-                f.write(json.dumps(local_data, ensure_ascii=False) + '\n')
-            
-            self.logger.info(f"扫描数据保存到本地: {barcode_data}")
+            if len(scans) == 1:
+                self.logger.info("扫描数据保存到本地: %s", scans[0][0])
+            else:
+                self.logger.info("扫描数据保存到本地: %d 条", len(scans))
             return True
             
         except Exception as e:
             self.logger.error(f"本地保存失败: {e}")
             return False
     
+    def _get_local_db(self) -> sqlite3.Connection:
+        """获取本地备份库连接，首次调用时建表并导入旧版 JSONL 备份（调用方需持有 _local_lock）"""
+        if self._local_db is None:
+            db_dir = os.path.join(self.local_data_dir, LOCAL_DB_SUBDIR)
+            os.makedirs(db_dir, exist_ok=True)
+            db_path = os.path.join(db_dir, LOCAL_DB_FILENAME)
+            self._move_old_local_db(db_path)
+            conn = sqlite3.connect(
+                db_path,
+                isolation_level=None,
+                check_same_thread=False
+            )
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS scans ('
+                ' id INTEGER PRIMARY KEY,'
+                ' barcode_data TEXT NOT NULL,'
+                ' device_port TEXT,'
+                ' scan_time TEXT NOT NULL,'
+                ' scan_ts_ms INTEGER,'
+                ' synced INTEGER NOT NULL DEFAULT 0)'
+            )
+            self._migrate_local_db(conn)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_scans_synced ON scans(synced)')
+            # 不重复条码计数按索引顺序去重，无需临时排序
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_scans_barcode_data ON scans(barcode_data)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_scans_scan_time ON scans(scan_time)')
+            # 今日扫描数按毫秒时间戳做索引范围查询
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_scans_scan_ts_ms ON scans(scan_ts_ms)')
+            self._local_db = conn
+            self._import_legacy_jsonl(conn)
+            self._import_legacy_backup_file(conn)
+        return self._local_db
+    
+    def _move_old_local_db(self, db_path: str):
+        """把旧版本直接放在本地数据目录下的 scans.db（及 WAL 文件）移到 SQLite 子目录"""
+        old_path = os.path.join(self.local_data_dir, LOCAL_DB_FILENAME)
+        if not os.path.exists(old_path) or os.path.exists(db_path):
+            return
+        # 先移动 WAL/SHM 文件，最后移动主库文件，中途失败时下次启动仍会重试
+        for suffix in ('-wal', '-shm', ''):
+            if os.path.exists(old_path + suffix):
+                os.replace(old_path + suffix, db_path + suffix)
+        self.logger.info(f"本地库已移动到 {db_path}")
+    
+    def _http_managed_files(self) -> set:
+        """返回由 HTTP 后端管理（已有同步账本或同步进度）的 scans_*.jsonl 文件名"""
+        managed = set()
+        offsets_path = os.path.join(self.local_data_dir, HTTP_SYNC_OFFSETS_FILENAME)
+        try:
+            with open(offsets_path, 'rb') as f:
+                offsets = _loads(f.read())
+            if isinstance(offsets, dict):
+                managed.update(offsets)
+        except (OSError, ValueError):
+            pass
+        
+        for filename in os.listdir(self.local_data_dir):
+            if filename.startswith('scans_') and filename.endswith(HTTP_LEDGER_SUFFIX):
+                managed.add(filename[:-len(HTTP_LEDGER_SUFFIX)] + '.jsonl')
+        return managed
+    
+    def _migrate_local_db(self, conn: sqlite3.Connection):
+        """升级旧版本地库：补充 scan_ts_ms 列并根据 scan_time 回填"""
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(scans)')}
+        if 'scan_ts_ms' in columns:
+            return
+        
+        conn.execute('BEGIN')
+        try:
+            conn.execute('ALTER TABLE scans ADD COLUMN scan_ts_ms INTEGER')
+            rows = conn.execute('SELECT id, scan_time FROM scans').fetchall()
+            conn.executemany('UPDATE scans SET scan_ts_ms = ? WHERE id = ?',
+                             [(_scan_time_ms(scan_time), row_id) for row_id, scan_time in rows])
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        self.logger.info(f"本地库已升级: 回填 {len(rows)} 条记录的 scan_ts_ms")
+    
+    @contextmanager
+    def _local_transaction(self):
+        """持有本地库锁并在一个事务中执行写操作"""
+        with self._local_lock:
+            conn = self._get_local_db()
+            conn.execute('BEGIN')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+    
+    def _import_legacy_jsonl(self, conn: sqlite3.Connection):
+        """
+        把旧版 scans_*.jsonl 备份导入本地库
+        
+        同步位置之前的记录视为已处理；导入后文件重命名为 .imported，不会重复导入。
+        .failed.jsonl 文件保留原样供人工处理；HTTP 后端管理的备份文件（有同步账本或同步进度）保持不动。
+        """
+        try:
+            filenames = sorted(os.listdir(self.local_data_dir))
+            http_managed = self._http_managed_files()
+        except FileNotFoundError:
+            return
+        
+        cursor = self._load_sync_cursor()
+        for filename in filenames:
+            if not filename.startswith('scans_') or not filename.endswith('.jsonl'):
+                continue
+            if filename.endswith(FAILED_SUFFIX) or filename in http_managed:
+                continue
+            
+            filepath = os.path.join(self.local_data_dir, filename)
+            offset = cursor.get(filename, 0)
+            rows = []
+            position = 0
+            try:
+                with open(filepath, 'rb') as f:
+                    for line in f:
+                        line_start = position
+                        position += len(line)
+                        try:
+                            record = _loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if not isinstance(record, dict) or 'barcode_data' not in record:
+                            continue
+                        done = line_start < offset or record.get('synced', False)
+                        scan_time = record.get('scan_time') or _iso_now()
+                        rows.append((
+                            record['barcode_data'],
+                            record.get('device_port'),
+                            scan_time,
+                            _scan_time_ms(scan_time),
+                            SYNC_DONE if done else SYNC_PENDING
+                        ))
+                
+                conn.execute('BEGIN')
+                try:
+                    conn.executemany(
+                        'INSERT INTO scans (barcode_data, device_port, scan_time, scan_ts_ms, synced) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        rows
+                    )
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+                conn.execute('COMMIT')
+                os.replace(filepath, filepath + '.imported')
+                self.logger.info(f"已导入旧版备份 {filename}: {len(rows)} 条记录")
+            except Exception as e:
+                self.logger.error(f"导入旧版备份失败 {filepath}: {e}")
+        
+        cursor_path = os.path.join(self.local_data_dir, SYNC_CURSOR_FILENAME)
+        if os.path.exists(cursor_path):
+            os.remove(cursor_path)
+    
+    def _import_legacy_backup_file(self, conn: sqlite3.Connection):
+        """
+        把更早版本的 JSON 数组备份文件（local_scan_backup.json）导入本地库
+        
+        该文件只保存上传失败的记录，全部作为待上传导入；导入后重命名为 .imported，不会重复导入。
+        """
+        filepath = os.getenv('LOCAL_BACKUP_FILENAME', LEGACY_BACKUP_FILENAME)
+        try:
+            with open(filepath, 'rb') as f:
+                records = _loads(f.read())
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.logger.error(f"读取旧版备份失败 {filepath}: {e}")
+            return
+        
+        rows = []
+        for record in records if isinstance(records, list) else []:
+            if not isinstance(record, dict) or 'barcode_data' not in record:
+                continue
+            scan_time = record.get('scan_time') or _iso_now()
+            rows.append((
+                record['barcode_data'],
+                record.get('device_port'),
+                scan_time,
+                _scan_time_ms(scan_time),
+                SYNC_PENDING
+            ))
+        
+        try:
+            conn.execute('BEGIN')
+            try:
+                conn.executemany(
+                    'INSERT INTO scans (barcode_data, device_port, scan_time, scan_ts_ms, synced) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    rows
+                )
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            os.replace(filepath, filepath + '.imported')
+            self.logger.info(f"已导入旧版备份 {filepath}: {len(rows)} 条待上传记录")
+        except Exception as e:
+            self.logger.error(f"导入旧版备份失败 {filepath}: {e}")
+    
     def upload_local_backup(self) -> int:
         """
         上传本地备份数据到数据库
         
+        按批读取本地库中待上传的记录，上传成功后标记为已同步。
+        
         Returns:
             成功上传的记录数
         """
-        if not self.client or not self.config['database_enabled']:
+        # 先处理完排队中的扫描，失败的会写入本地库一并同步
+        self.flush()
+        
+        if not self.client or not self.config.database_enabled:
             self.logger.warning("数据库不可用，无法上传本地备份")
             return 0
         
-        if not self.config['auto_sync_enabled']:
+        if not self.config.auto_sync_enabled:
             self.logger.info("自动同步已禁用")
             return 0
         
-        backup_filename = self.config['local_backup_filename']
-        
-        try:
-            with open(backup_filename, 'r', encoding='utf-8') as f:
-                backup_data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
+        if not self.config.local_backup_enabled:
             self.logger.info("没有找到本地备份数据")
             return 0
         
         uploaded_count = 0
-        failed_data = []
+        try:
+            while True:
+                with self._local_lock:
+                    rows = self._get_local_db().execute(
+                        'SELECT id, barcode_data, device_port, scan_time FROM scans '
+                        'WHERE synced = ? ORDER BY id LIMIT ?',
+                        (SYNC_PENDING, UPLOAD_BATCH_SIZE)
+                    ).fetchall()
+                if not rows:
+                    break
+                
+                uploaded_ids, rejected_ids, ok = self._upload_backup_batch(rows)
+                with self._local_transaction() as conn:
+                    conn.executemany('UPDATE scans SET synced = ? WHERE id = ?',
+                                     [(SYNC_DONE, row_id) for row_id in uploaded_ids] +
+                                     [(SYNC_REJECTED, row_id) for row_id in rejected_ids])
+                uploaded_count += len(uploaded_ids)
+                
+                if not ok or len(rows) < UPLOAD_BATCH_SIZE:
+                    break
+        except Exception as e:
+            self.logger.error(f"上传本地备份失败: {e}")
+        
+        self.logger.info(f"本地备份上传完成: {uploaded_count} 条记录成功")
+        return uploaded_count
+    
+    def _upload_backup_batch(self, rows: List[tuple]) -> tuple:
+        """
+        批量上传一批本地库记录
+        
+        Args:
+            rows: (id, 条码数据, 设备端口, 扫描时间) 列表
+            
+        Returns:
+            (上传成功的 id 列表, 被服务器拒绝的 id 列表, 是否可以继续上传后续批次)
+        """
+        payload = [
+            {
+                'barcode_data': barcode_data,
+                'device_port': device_port or 'unknown',
+                'scan_time': scan_time
+            }
+            for _, barcode_data, device_port, scan_time in rows
+        ]
         
-        for record in backup_data:
+        try:
+            response = self.client.table('barcode_scans').insert(payload).execute()
+            if response.data:
+                return [row[0] for row in rows], [], True
+            self.logger.warning("批量上传无响应数据，改为逐条上传")
+        except Exception as e:
+            self.logger.warning(f"批量上传失败，改为逐条上传: {e}")
+        
+        # 批量失败时逐条上传，隔离出被服务器拒绝的记录
+        uploaded_ids = []
+        rejected_ids = []
+        for row, scan_data in zip(rows, payload):
             try:
-                scan_data = {
-                    'barcode_data': record['barcode_data'],
-                    'device_port': record['device_port'],
-                    'scan_time': record.get('scan_time', datetime.now().isoformat())
-                }
-                
                 response = self.client.table('barcode_scans').insert(scan_data).execute()
                 
                 if response.data:
-                    uploaded_count += 1
+                    uploaded_ids.append(row[0])
                 else:
-                    failed_data.append(record)
+                    rejected_ids.append(row[0])
                     
             except Exception as e:
+                if APIError is None or not isinstance(e, APIError):
+                    # 网络等临时错误：剩余记录保持待上传，下次重试
+                    self.logger.error(f"上传备份记录失败，稍后重试: {e}")
+                    return uploaded_ids, rejected_ids, False
                 self.logger.error(f"上传备份记录失败: {e}")
-                failed_data.append(record)
-        
-        # 更新本地备份文件（只保留失败的记录）
-        if failed_data:
-            with open(backup_filename, 'w', encoding='utf-8') as f:
-                json.dump(failed_data, f, ensure_ascii=False, indent=2)
-        else:
-            # 所有数据上传成功，删除备份文件
-            try:
-                os.remove(backup_filename)
-            except:
-                pass
+                rejected_ids.append(row[0])
         
-        self.logger.info(f"本地备份上传完成: {uploaded_count} 条记录成功")
-        return uploaded_count
+        if rejected_ids:
+            self.logger.warning(f"{len(rejected_ids)} 条记录被服务器拒绝，已在本地库中标记为失败")
+        return uploaded_ids, rejected_ids, True
     
-
+    def _load_sync_cursor(self) -> Dict[str, int]:
+        """读取旧版 JSONL 备份文件的同步位置"""
+        cursor_path = os.path.join(self.local_data_dir, SYNC_CURSOR_FILENAME)
+        try:
+            with open(cursor_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
     
     def get_recent_scans(self, limit: int = 50) -> List[Dict]:
         """获取最近的扫描记录"""
@@ -262,19 +777,25 @@ class DatabaseManager:
             return []
     
     def _get_local_scans(self, limit: int = 50) -> List[Dict]:
-        """从本地备份获取扫描记录"""
-        backup_filename = self.config['local_backup_filename']
+        """从本地备份库获取最近的扫描记录（按 scan_time 索引倒序读取前 limit 条）"""
+        if not self.config.local_backup_enabled:
+            return []
         
         try:
-            with open(backup_filename, 'r', encoding='utf-8') as f:
-                backup_data = json.load(f)
-            
-            # 按时间倒序排列并限制数量
-            backup_data.sort(key=lambda x: x.get('scan_time', ''), reverse=True)
-            return backup_data[:limit]
-            
-        except (FileNotFoundError, json.JSONDecodeError):
+            with self._local_lock:
+                rows = self._get_local_db().execute(
+                    'SELECT barcode_data, device_port, scan_time FROM scans '
+                    'ORDER BY scan_time DESC LIMIT ?',
+                    (limit,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            self.logger.error(f"读取本地扫描记录失败: {e}")
             return []
+        
+        return [
+            {'barcode_data': barcode_data, 'device_port': device_port, 'scan_time': scan_time}
+            for barcode_data, device_port, scan_time in rows
+        ]
     
     def get_scan_statistics(self) -> Dict[str, Any]:
         """获取扫描统计信息"""
@@ -282,24 +803,20 @@ class DatabaseManager:
             return self._get_local_statistics()
         
         try:
-            # 总扫描次数
+            # 总扫描次数（head=True 只取 Content-Range 中的计数，不下载记录）
             total_response = self.client.table('barcode_scans')\
-                .select('*', count='exact')\
+                .select('id', count='exact', head=True)\
                 .execute()
             
             # 今日扫描次数
             today = datetime.now().date().isoformat()
             today_response = self.client.table('barcode_scans')\
-                .select('*', count='exact')\
+                .select('id', count='exact', head=True)\
                 .gte('scan_time', today)\
                 .execute()
             
-            # 不重复条码数
-            unique_response = self.client.table('barcode_scans')\
-                .select('barcode_data')\
-                .execute()
-            
-            unique_barcodes = len(set(item['barcode_data'] for item in unique_response.data)) if unique_response.data else 0
+            # 不重复条码数（在数据库端计算）
+            unique_barcodes = self._count_distinct_barcodes()
             
             return {
                 'total_scans': total_response.count or 0,
@@ -312,31 +829,66 @@ class DatabaseManager:
             self.logger.error(f"获取统计信息失败: {e}")
             return {'total_scans': 0, 'today_scans': 0, 'unique_barcodes': 0}
     
+    def _count_distinct_barcodes(self) -> int:
+        """统计不重复条码数，优先调用数据库函数 count_distinct_barcodes"""
+        try:
+            response = self.client.rpc('count_distinct_barcodes').execute()
+            return int(response.data or 0)
+        except Exception as e:
+            # 数据库未创建该函数时退回旧方式（拉取全部条码在本地去重）
+            self.logger.warning(f"调用 count_distinct_barcodes 失败，改为本地去重: {e}")
+            response = self.client.table('barcode_scans')\
+                .select('barcode_data')\
+                .execute()
+            return len(set(item['barcode_data'] for item in response.data)) if response.data else 0
+    
     def _get_local_statistics(self) -> Dict[str, Any]:
-        """从本地备份获取统计信息"""
-        backup_filename = self.config['local_backup_filename']
+        """从本地备份库统计"""
+        if not self.config.local_backup_enabled:
+            return {'total_scans': 0, 'today_scans': 0, 'unique_barcodes': 0}
         
+        today_start_ms = int(datetime.combine(datetime.now().date(), datetime.min.time()).timestamp() * 1000)
         try:
-            with open(backup_filename, 'r', encoding='utf-8') as f:
-                backup_data = json.load(f)
-            
-            today = datetime.now().date().isoformat()
-            today_scans = sum(1 for item in backup_data if item.get('scan_time', '').startswith(today))
-            unique_barcodes = len(set(item['barcode_data'] for item in backup_data))
-
-            return {
-                'total_scans': len(backup_data),
-                'today_scans': today_scans,
-                'unique_barcodes': unique_barcodes,
-                'last_scan_time': backup_data[0].get('scan_time') if backup_data else None
-            }
-            
-        except (FileNotFoundError, json.JSONDecodeError):
+            with self._local_lock:
+                conn = self._get_local_db()
+                total_scans, = conn.execute('SELECT COUNT(*) FROM scans').fetchone()
+                # 今日扫描数和最后扫描时间都只需在索引上定位，不扫描全表
+                today_scans, = conn.execute(
+                    'SELECT COUNT(*) FROM scans WHERE scan_ts_ms >= ?', (today_start_ms,)
+                ).fetchone()
+                last_scan_time, = conn.execute('SELECT MAX(scan_time) FROM scans').fetchone()
+                # 不重复条码数单独查询，以便走 barcode_data 覆盖索引而不是临时排序
+                unique_barcodes, = conn.execute(
+                    'SELECT COUNT(DISTINCT barcode_data) FROM scans'
+                ).fetchone()
+        except sqlite3.Error as e:
+            self.logger.error(f"读取本地统计失败: {e}")
             return {'total_scans': 0, 'today_scans': 0, 'unique_barcodes': 0}
+        
+        return {
+            'total_scans': total_scans,
+            'today_scans': today_scans,
+            'unique_barcodes': unique_barcodes,
+            'last_scan_time': last_scan_time
+        }
 
 
-# 全局数据库管理器实例（自动从环境变量初始化）
-db_manager = DatabaseManager()
+# 全局数据库管理器实例（首次使用时从环境变量初始化）
+db_manager = None
+
+def _get_manager() -> DatabaseManager:
+    """获取全局数据库管理器，首次调用时创建"""
+    global db_manager
+    if db_manager is None:
+        db_manager = DatabaseManager()
+    return db_manager
+
+def _flush_at_exit():
+    """程序退出前把排队中的扫描上传或转存本地"""
+    if db_manager is not None:
+        db_manager.flush()
+
+atexit.register(_flush_at_exit)
 
 def configure_database_connection(supabase_url: str = None, supabase_key: str = None):
     """
@@ -348,32 +900,35 @@ def configure_database_connection(supabase_url: str = None, supabase_key: str =
     """
     global db_manager
     if supabase_url or supabase_key:
-        db_manager.configure_database(supabase_url, supabase_key)
+        _get_manager().configure_database(supabase_url, supabase_key)
     else:
-        # 重新初始化以读取最新的环境变量
+        # 重新初始化以读取最新的环境变量，旧实例中排队的扫描先处理完
+        if db_manager is not None:
+            db_manager.flush()
+        _env_bool.cache_clear()
         db_manager = DatabaseManager()
 
 def upload_barcode_scan(barcode_data: str, device_port: str) -> bool:
     """上传条码扫描数据"""
-    return db_manager.upload_scan_data(barcode_data, device_port)
+    return _get_manager().upload_scan_data(barcode_data, device_port)
 
 def upload_scan_data(barcode_data: str, device_port: str) -> bool:
     """上传扫描数据（兼容性函数）"""
-    return db_manager.upload_scan_data(barcode_data, device_port)
+    return _get_manager().upload_scan_data(barcode_data, device_port)
 
 
 
 def get_scan_history(limit: int = 50) -> List[Dict]:
     """获取扫描历史"""
-    return db_manager.get_recent_scans(limit)
+    return _get_manager().get_recent_scans(limit)
 
 def get_statistics() -> Dict[str, Any]:
     """获取扫描统计"""
-    return db_manager.get_scan_statistics()
+    return _get_manager().get_scan_statistics()
 
 def sync_local_data() -> int:
     """同步本地数据到数据库"""
-    return db_manager.upload_local_backup()
+    return _get_manager().upload_local_backup()
 
 
 def check_configuration():
@@ -402,7 +957,7 @@ def check_configuration():
         print(f"✅ SUPABASE_KEY: {supabase_key[:20]}...")
     
     # 检查 Supabase 库
-    if not SUPABASE_AVAILABLE:
+    if not _import_supabase():
         print("❌ supabase 库未安装")
         return False
     else:
@@ -424,9 +979,9 @@ def check_configuration():
         
 
         
-        print(f"✅ 数据库上传: {'启用' if os.getenv('DATABASE_ENABLED', 'true').lower() == 'true' else '禁用'}")
-        print(f"✅ 本地备份: {'启用' if os.getenv('LOCAL_BACKUP_ENABLED', 'true').lower() == 'true' else '禁用'}")
-        print(f"✅ 自动同步: {'启用' if os.getenv('AUTO_SYNC_ENABLED', 'true').lower() == 'true' else '禁用'}")
+        print(f"✅ 数据库上传: {'启用' if _env_bool('DATABASE_ENABLED') else '禁用'}")
+        print(f"✅ 本地备份: {'启用' if _env_bool('LOCAL_BACKUP_ENABLED') else '禁用'}")
+        print(f"✅ 自动同步: {'启用' if _env_bool('AUTO_SYNC_ENABLED') else '禁用'}")
         print(f"✅ 日志级别: {os.getenv('LOG_LEVEL', 'INFO')}")
         return True
         
@@ -446,7 +1001,7 @@ if __name__ == "__main__":
     
     print("\n=== 功能测试 ===")
     
-    # 注意：数据库管理器已自动从环境变量初始化
+    # 注意：数据库管理器会在首次使用时自动从环境变量初始化
     # 不需要手动调用 configure_database_connection()
     
 
@@ -466,7 +1021,7 @@ if __name__ == "__main__":
     print(f"扫描统计: {stats}")
     
     # 测试本地数据同步
-    if os.getenv('AUTO_SYNC_ENABLED', 'true').lower() == 'true':
+    if _env_bool('AUTO_SYNC_ENABLED'):
         print("测试本地数据同步...")
         synced = sync_local_data()
         print(f"同步了 {synced} 条记录")
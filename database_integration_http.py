@@ -3,13 +3,22 @@
 使用HTTP请求直接与Supabase API通信，避免库兼容性问题
 """
 
+import gzip
 import json
 import os
+import time
+import functools
+import threading
+import queue
+import atexit
+from collections import OrderedDict
 import requests
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from datetime import datetime, timedelta
 from typing import Optional, Dict, List, Any
 import logging
-import pytz  # 添加时区支持
+from concurrent.futures import ThreadPoolExecutor
 
 # 加载环境变量
 try:
@@ -20,6 +29,126 @@ except ImportError:
     DOTENV_AVAILABLE = False
     print("提示: python-dotenv 库未安装，将直接使用系统环境变量。运行: pip install python-dotenv")
 
+# 优先使用 orjson 加速 JSON 序列化，未安装时退回标准库
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+def _dumps(obj) -> bytes:
+    """把对象序列化为 JSON（UTF-8 字节），用于本地文件和请求体"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+def _loads(data):
+    """解析 JSON 文本或字节"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# 条码状态前缀 -> 状态
+_STATUS_TABLE = {
+    '0@': '已排产',
+    '1@': '已切割',
+    '2@': '已清角',
+    '3@': '已入库',
+    '4@': '部分出库',
+    '5@': '已出库'
+}
+
+# 状态 -> 条码前缀数字（由 _STATUS_TABLE 反向生成）
+_STATUS_PREFIX = {status: prefix[0] for prefix, status in _STATUS_TABLE.items()}
+
+@functools.lru_cache(maxsize=1024)
+def _parse_barcode_status(barcode_data: str) -> tuple:
+    """按前两个字符查表解析状态（结果缓存，同一条码重复扫描时直接命中）"""
+    status = _STATUS_TABLE.get(barcode_data[:2])
+    if status:
+        return barcode_data[2:], status
+    return barcode_data, None
+
+# 本地时间字符串缓存 (毫秒时间戳, 格式化结果)，同一毫秒内的调用复用同一个值
+_time_cache = (0, '')
+
+def _local_time_str() -> str:
+    """返回当前本地时间的数据库兼容格式字符串（精确到毫秒，按毫秒缓存）"""
+    global _time_cache
+    now_ms = time.time_ns() // 1_000_000
+    cached_ms, cached_s = _time_cache
+    if now_ms != cached_ms:
+        cached_s = datetime.fromtimestamp(now_ms / 1000).isoformat(sep=' ', timespec='milliseconds')
+        _time_cache = (now_ms, cached_s)
+    return cached_s
+
+# 状态 -> (状态字段, 时间字段)
+_STATUS_FIELD_MAP = {
+    '已排产': ('status_1_scheduled', 'status_1_time'),
+    '已切割': ('status_2_cut', 'status_2_time'),
+    '已清角': ('status_3_cleaned', 'status_3_time'),
+    '已入库': ('status_4_stored', 'status_4_time'),
+    '部分出库': ('status_5_partial_out', 'status_5_time'),
+    '已出库': ('status_6_shipped', 'status_6_time')
+}
+
+# 按 barcode_data 合并写入（upsert）时附加的请求头
+_UPSERT_HEADERS = {'Prefer': 'resolution=merge-duplicates,return=minimal'}
+_UPSERT_GZIP_HEADERS = {**_UPSERT_HEADERS, 'Content-Encoding': 'gzip'}
+
+# 批量请求体超过该大小（字节）时才压缩，小请求压缩收益不抵开销
+GZIP_MIN_BYTES = 4096
+
+# 写入（POST/PATCH/upsert）与读取（含分页 206）成功的 HTTP 状态码
+_OK_WRITE = frozenset({200, 201, 204})
+_OK_READ = frozenset({200, 206})
+
+# 错误日志中记录的响应内容最大长度
+ERROR_TEXT_LIMIT = 500
+
+# 连接测试（HEAD 探测）的读取超时（秒），界面启动时同步调用，不使用常规请求的长读取超时
+PROBE_READ_TIMEOUT = 2.0
+
+def _error_text(response) -> str:
+    """读取失败响应的内容用于日志（仅在错误分支调用，截断过长的响应）"""
+    return (response.text or 'Unknown error')[:ERROR_TEXT_LIMIT]
+
+def _rejects_gzip(response) -> bool:
+    """判断失败响应是否表示服务器不接受 gzip 压缩的请求体（415，或错误内容提到 Content-Encoding）"""
+    if response.status_code == 415:
+        return True
+    return 400 <= response.status_code < 500 and 'content-encoding' in (response.text or '').lower()
+
+# 最近上传成功的 (条码, 状态) 在该时间（秒）内再次扫描时不重复上传
+SCAN_CACHE_TTL = 120
+# 最近上传缓存的最大条目数，超出时淘汰最久未使用的条目
+SCAN_CACHE_SIZE = 4096
+
+# 同步账本文件后缀：scans_YYYY-MM-DD.synced 记录已同步行的起始字节位置
+LEDGER_SUFFIX = '.synced'
+
+# 被服务器拒绝（重试无效）的记录转存文件，不再自动同步，供人工处理
+DEAD_LETTER_FILENAME = 'dead_letter.jsonl'
+
+# 同步进度文件：各备份文件中"此位置之前的记录均已处理"的字节位置，同步时从该位置继续读取
+SYNC_OFFSETS_FILENAME = '.offsets.json'
+
+def _ledger_path(filepath: str) -> str:
+    """本地备份文件 scans_<日期>.jsonl 对应的同步账本路径"""
+    return filepath[:-len('.jsonl')] + LEDGER_SUFFIX
+
+# 同步本地数据时的最大并发请求数（不超过会话连接池大小）
+SYNC_MAX_WORKERS = 16
+
+# 同步本地数据时每个批量 upsert 请求包含的最大行数
+SYNC_BATCH_SIZE = 500
+# 同步时内存中最多累积的待上传记录数，达到后先上传并写账本再继续读文件
+SYNC_WINDOW_SIZE = SYNC_MAX_WORKERS * SYNC_BATCH_SIZE
+
+# 后台自动同步：网络异常后的退避基数与上限（秒），按 2 的幂次增长
+SYNC_BACKOFF_BASE = 5
+SYNC_BACKOFF_MAX = 60
+
 class DatabaseManagerHTTP:
     """基于HTTP请求的数据库管理器"""
     
@@ -35,9 +164,6 @@ class DatabaseManagerHTTP:
         self.supabase_url = supabase_url or os.getenv('SUPABASE_URL')
         self.supabase_key = supabase_key or os.getenv('SUPABASE_KEY')
         
-        # 设置太平洋时区
-        self.pacific_timezone = pytz.timezone('America/Los_Angeles')
-        
         # 构建API端点
         if self.supabase_url:
             self.api_url = f"{self.supabase_url}/rest/v1"
@@ -47,9 +173,16 @@ class DatabaseManagerHTTP:
                 'Content-Type': 'application/json',
                 'Prefer': 'return=minimal'
             }
+            # 热路径端点预先拼好，过滤条件通过 params 传入（由 requests 负责 URL 编码）
+            self._scans_url = f"{self.api_url}/barcode_scans"
+            self._upsert_url = f"{self._scans_url}?on_conflict=barcode_data"
+            self.session = self._create_session()
         else:
             self.api_url = None
+            self._scans_url = None
+            self._upsert_url = None
             self.headers = None
+            self.session = None
         
         # 从环境变量读取配置选项
         self.config = {
@@ -57,16 +190,65 @@ class DatabaseManagerHTTP:
             'local_backup_enabled': os.getenv('LOCAL_BACKUP_ENABLED', 'true').lower() == 'true',
             'local_backup_filename': os.getenv('LOCAL_BACKUP_FILENAME', 'local_scan_backup.json'),
             'auto_sync_enabled': os.getenv('AUTO_SYNC_ENABLED', 'true').lower() == 'true',
+            'upload_batch_size': max(int(os.getenv('UPLOAD_BATCH_SIZE', '100')), 1),
+            'flush_interval_ms': max(int(os.getenv('FLUSH_INTERVAL_MS', '100')), 0),
+            'fsync_interval': max(float(os.getenv('LOCAL_FSYNC_INTERVAL', '1.0')), 0.05),
+            'auto_sync_interval': max(float(os.getenv('AUTO_SYNC_INTERVAL', '60')), 1.0),
+            'gzip_requests': os.getenv('HTTP_GZIP_REQUESTS', 'false').lower() == 'true',
+            'http_connect_timeout': float(os.getenv('HTTP_CONNECT_TIMEOUT', '3')),
+            'http_read_timeout': float(os.getenv('HTTP_READ_TIMEOUT', '15')),
             'log_level': os.getenv('LOG_LEVEL', 'INFO').upper()
         }
         
+        # 请求超时 (连接, 读取)：连接阶段快速失败，不占用整批上传的等待时间；批量请求的读取超时更长
+        self._timeout = (self.config['http_connect_timeout'], self.config['http_read_timeout'])
+        self._bulk_timeout = (self.config['http_connect_timeout'], max(self.config['http_read_timeout'], 30.0))
+        self._probe_timeout = (self.config['http_connect_timeout'], min(self.config['http_read_timeout'], PROBE_READ_TIMEOUT))
+        
         # 设置本地数据目录
         self.local_data_dir = os.getenv('LOCAL_DATA_DIR', 'local_data')
         
+        # 数据库是否支持按 barcode_data upsert（首次发现缺少唯一约束后关闭）
+        self._upsert_supported = True
+        
+        # 当天本地备份文件 (下一个零点的时间戳, 文件句柄)，首次写入时打开
+        self._local_file = None
+        self._local_file_lock = threading.Lock()
+        # 自上次 fsync 以来是否有新的写入（由后台线程定期落盘，多次写入合并为一次 fsync）
+        self._local_file_dirty = False
+        
+        # 最近上传成功的 (条码, 状态) -> 上传时间（monotonic），用于跳过连续重复扫描
+        self._scan_cache = OrderedDict()
+        self._scan_cache_lock = threading.Lock()
+        
+        # 同步账本追加写入锁（后台上传线程与同步线程都会写账本）
+        self._ledger_lock = threading.Lock()
+        
+        # 扫描上传队列：扫描线程只负责入队，由后台线程合并为批量 upsert
+        self._queue = queue.Queue()
+        
+        # 同步互斥（后台自动同步与手动同步不并行）、网络异常计数，
+        # 以及各备份文件的同步进度（文件名 -> 字节位置，首次同步时从 SYNC_OFFSETS_FILENAME 读取）
+        self._sync_lock = threading.Lock()
+        self._sync_failures = 0
+        
+        # 运行统计：转入死信文件的记录数
+        self.stats = {'dead_letter': 0}
+        self._sync_offsets = None
+        
         # 设置日志
         log_level = getattr(logging, self.config['log_level'], logging.INFO)
-        logging.basicConfig(level=log_level)
+        if not logging.getLogger().handlers:
+            logging.basicConfig(level=log_level)
         self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(log_level)
+        
+        # 启动后台上传线程和本地备份落盘线程
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+        if self.config['local_backup_enabled']:
+            threading.Thread(target=self._fsync_loop, daemon=True).start()
+        if self.session and self.config['database_enabled'] and self.config['auto_sync_enabled']:
+            threading.Thread(target=self._sync_loop, daemon=True).start()
         
         # 显示配置信息
         if self.supabase_url and self.supabase_key:
@@ -74,6 +256,33 @@ class DatabaseManagerHTTP:
         else:
             self.logger.warning("未找到数据库配置，将使用离线模式")
     
+    def _create_session(self) -> requests.Session:
+        """创建复用连接的HTTP会话（保持长连接，避免每次扫描都重新进行TCP/TLS握手）"""
+        session = requests.Session()
+        session.headers.update(self.headers)
+        session.headers['Connection'] = 'keep-alive'
+        
+        # 对限流和服务端错误按指数退避自动重试（遵循 Retry-After），避免网络抖动时扫描立即落入本地备份。
+        # 普通 POST（upsert 不可用时的 _create_new_record）不重试：服务器已提交但返回 5xx 时重放会插入重复记录
+        retry = Retry(
+            total=3,
+            backoff_factor=0.2,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'PATCH', 'HEAD']),
+            respect_retry_after_header=True
+        )
+        # 连接池需容纳同步时的 SYNC_MAX_WORKERS 个并发请求，外加后台上传线程和界面查询
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=SYNC_MAX_WORKERS * 2, max_retries=retry)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        
+        # on_conflict upsert 按条码合并，重放不会产生重复记录，只对该端点的 POST 也重试
+        # （requests 按最长前缀选择适配器）
+        upsert_retry = retry.new(allowed_methods=frozenset(['POST']))
+        session.mount(self._upsert_url,
+                      HTTPAdapter(pool_connections=1, pool_maxsize=SYNC_MAX_WORKERS * 2, max_retries=upsert_retry))
+        return session
+    
     def _parse_barcode_status(self, barcode_data: str) -> tuple:
         """
         解析条码数据中的状态信息
@@ -84,24 +293,48 @@ class DatabaseManagerHTTP:
         Returns:
             (clean_barcode_data, status): 清理后的条码数据和状态
         """
-        if barcode_data.startswith('0@'):
-            return barcode_data[2:], '已排产'
-        elif barcode_data.startswith('1@'):
-            return barcode_data[2:], '已切割'
-        elif barcode_data.startswith('2@'):
-            return barcode_data[2:], '已清角'
-        elif barcode_data.startswith('3@'):
-            return barcode_data[2:], '已入库'
-        elif barcode_data.startswith('4@'):
-            return barcode_data[2:], '部分出库'
-        elif barcode_data.startswith('5@'):
-            return barcode_data[2:], '已出库'
-        else:
-            return barcode_data, None
+        return _parse_barcode_status(barcode_data)
 
     def upload_scan_data(self, barcode_data: str, device_port: str) -> bool:
         """
-        上传扫描数据 - 使用现有barcode_scans表
+        上传扫描数据（异步）
+        
+        数据库可用时先把扫描追加到本地备份文件（未同步），再放入上传队列并立即返回，
+        由后台线程合并为一次批量 upsert，上传成功后把记录位置写入同步账本；
+        程序在上传前退出时，记录仍在本地备份中，下次同步时补传。数据库不可用时直接保存到本地。
+        
+        Args:
+            barcode_data: 条码数据
+            device_port: 设备端口
+            
+        Returns:
+            数据是否已入队或保存
+        """
+        if not self.api_url or not self.config['database_enabled']:
+            return self.upload_scan_data_sync(barcode_data, device_port)
+        
+        clean_barcode_data, status = self._parse_barcode_status(barcode_data)
+        if not status:
+            self.logger.warning("无法识别状态的条码: %s", barcode_data)
+            return False
+        
+        if self._recently_uploaded((clean_barcode_data, status)):
+            self.logger.debug("重复扫描，跳过上传: %s", barcode_data)
+            return True
+        
+        record = {
+            'barcode_data': clean_barcode_data,
+            'scan_time': self._get_pacific_time(),
+            'device_port': device_port,
+            'status': status
+        }
+        locations = self._save_records_to_local([record])
+        self._queue.put((record, locations[0] if locations else None))
+        return True
+    
+    def upload_scan_data_sync(self, barcode_data: str, device_port: str) -> bool:
+        """
+        同步上传单条扫描数据（阻塞直到请求完成）
         
         Args:
             barcode_data: 条码数据
@@ -118,66 +351,259 @@ class DatabaseManagerHTTP:
                 self.logger.warning("数据库不可用且本地备份已禁用，数据将丢失")
                 return False
         
+        # 解析条码数据中的状态信息
+        clean_barcode_data, status = self._parse_barcode_status(barcode_data)
+        
+        if not status:
+            self.logger.warning("无法识别状态的条码: %s", barcode_data)
+            return False
+        
+        # 同一条码同一状态刚刚上传过，直接视为成功
+        cache_key = (clean_barcode_data, status)
+        if self._recently_uploaded(cache_key):
+            self.logger.debug("重复扫描，跳过上传: %s", barcode_data)
+            return True
+        
+        # 先写入本地备份（未同步），上传成功后只把记录位置写入同步账本，不再重复写入记录
+        record = {
+            'barcode_data': clean_barcode_data,
+            'scan_time': self._get_pacific_time(),
+            'device_port': device_port,
+            'status': status
+        }
+        locations = self._save_records_to_local([record])
+        
         try:
-            # 解析条码数据中的状态信息
-            clean_barcode_data, status = self._parse_barcode_status(barcode_data)
-            
-            if not status:
-                self.logger.warning(f"无法识别状态的条码: {barcode_data}")
+            if not self._write_record(clean_barcode_data, status, device_port, record['scan_time']):
                 return False
-            
-            # 首先检查记录是否存在
-            existing_record = self._get_existing_record(clean_barcode_data)
-            
-            if existing_record:
-                # 更新现有记录
-                return self._update_existing_record(existing_record, status, device_port)
-            else:
-                # 创建新记录
-                return self._create_new_record(clean_barcode_data, status, device_port)
-                
         except Exception as e:
-            self.logger.error(f"扫描数据上传失败: {e}")
-            # 上传失败时保存到本地
-            if self.config['local_backup_enabled']:
-                return self._save_to_local(barcode_data, device_port)
-            return False
+            # 上传失败时记录已在本地备份中，等待同步
+            self.logger.error("扫描数据上传失败: %s", e)
+            return locations is not None
+        
+        self._remember_upload(cache_key)
+        if locations:
+            filepath, offset = locations[0]
+            self._append_ledger(_ledger_path(filepath), [offset])
+        return True
 
+    def _flush_loop(self):
+        """后台上传线程：从队列凑批后一次批量 upsert"""
+        batch_size = self.config['upload_batch_size']
+        interval = self.config['flush_interval_ms'] / 1000
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + interval
+            while len(batch) < batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            try:
+                self._flush_batch(batch)
+            except Exception as e:
+                self.logger.error("后台上传线程异常: %s", e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    def _flush_batch(self, batch: List[tuple]):
+        """
+        批量上传一批排队的扫描 [(记录, 本地备份位置), ...]
+        
+        上传成功的记录把本地备份位置写入同步账本；失败的记录已在本地备份中，等待下次同步。
+        """
+        records = [record for record, _ in batch]
+        uploaded, rejected = [], []
+        for items in self._build_sync_batches(records):
+            batch_uploaded, batch_rejected = self._sync_batch(items)
+            uploaded.extend(batch_uploaded)
+            rejected.extend(batch_rejected)
+        
+        uploaded_ids = {id(record) for record in uploaded}
+        rejected_ids = {id(record) for record in rejected} if self._dead_letter(rejected) else set()
+        synced_offsets = {}
+        unsaved = []
+        for record, location in batch:
+            if id(record) in uploaded_ids:
+                self._remember_upload((record['barcode_data'], record['status']))
+            elif id(record) not in rejected_ids:
+                if not location:
+                    unsaved.append(record)
+                continue
+            # 上传成功或已转入死信文件的记录都不再需要同步
+            if location:
+                synced_offsets.setdefault(location[0], []).append(location[1])
+        
+        for filepath, offsets in synced_offsets.items():
+            self._append_ledger(_ledger_path(filepath), offsets)
+        
+        failed_count = len(batch) - len(uploaded_ids) - len(rejected_ids)
+        if failed_count:
+            self.logger.error("%d 条扫描数据上传失败，已保留在本地等待同步", failed_count)
+        # 入队时未能写入本地备份的失败记录，再尝试保存一次
+        self._save_records_to_local(unsaved)
+    
+    def flush(self, timeout: float = 5.0) -> bool:
+        """
+        等待上传队列清空
+        
+        超时后仍在排队的扫描会被转存到本地，避免退出时丢失。
+        
+        Returns:
+            队列是否在超时前全部处理完成
+        """
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(0.05)
+        else:
+            return True
+        
+        pending = []
+        while True:
+            try:
+                pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if pending:
+            # 已写入本地备份的记录无需处理，下次同步时补传
+            self._save_records_to_local([record for record, location in pending if not location])
+            for _ in pending:
+                self._queue.task_done()
+            self.logger.warning("上传队列等待超时，%s 条扫描数据已转存本地", len(pending))
+        return False
+
+    def _recently_uploaded(self, cache_key: tuple) -> bool:
+        """检查 (条码, 状态) 是否在 SCAN_CACHE_TTL 秒内上传成功过"""
+        with self._scan_cache_lock:
+            uploaded_at = self._scan_cache.get(cache_key)
+            if uploaded_at is None:
+                return False
+            if time.monotonic() - uploaded_at > SCAN_CACHE_TTL:
+                del self._scan_cache[cache_key]
+                return False
+            self._scan_cache.move_to_end(cache_key)
+            return True
+    
+    def _remember_upload(self, cache_key: tuple):
+        """记录上传成功的 (条码, 状态)"""
+        with self._scan_cache_lock:
+            self._scan_cache[cache_key] = time.monotonic()
+            self._scan_cache.move_to_end(cache_key)
+            if len(self._scan_cache) > SCAN_CACHE_SIZE:
+                self._scan_cache.popitem(last=False)
+    
+    def _write_record(self, barcode_data: str, status: str, device_port: str,
+                      scan_time: str = None) -> bool:
+        """
+        把一条带状态的扫描写入数据库
+        
+        Args:
+            barcode_data: 去掉状态前缀的条码数据
+            status: 状态
+            device_port: 设备端口
+            scan_time: 状态时间（默认为当前时间，同步本地数据时使用原扫描时间）
+        """
+        # 优先用一次 upsert 请求完成插入或更新
+        if self._upsert_supported:
+            result = self._upsert_record(barcode_data, status, device_port, scan_time)
+            if result is not None:
+                return result
+        
+        # 数据库不支持 upsert 时退回：先查询记录是否存在
+        existing_record = self._get_existing_record(barcode_data)
+        
+        if existing_record:
+            # 更新现有记录
+            return self._update_existing_record(existing_record, status, device_port, scan_time)
+        else:
+            # 创建新记录
+            return self._create_new_record(barcode_data, status, device_port, scan_time)
+    
+    def _upsert_record(self, barcode_data: str, status: str, device_port: str,
+                       scan_time: str = None) -> Optional[bool]:
+        """
+        使用 PostgREST upsert 一次请求插入或更新条码记录（需要 barcode_data 唯一约束）
+        
+        Returns:
+            是否成功；数据库缺少唯一约束时返回 None，由调用方退回查询+更新/插入
+        """
+        current_time = scan_time or self._get_pacific_time()
+        scan_data = {
+            'barcode_data': barcode_data,
+            'device_port': device_port
+        }
+        scan_data.update(self._status_fields(status, current_time))
+        
+        self.logger.debug("尝试upsert记录，数据: %s", scan_data)
+        response = self.session.post(
+            self._upsert_url,
+            headers=_UPSERT_HEADERS,
+            data=_dumps(scan_data),
+            timeout=self._timeout
+        )
+        
+        if response.status_code in _OK_WRITE:
+            self.logger.info("条码记录写入成功: %s (状态: %s) [本地时间: %s]", barcode_data, status, current_time)
+            return True
+        
+        error_text = _error_text(response)
+        if response.status_code == 400 and '42P10' in error_text:
+            # 42P10: 没有与 ON CONFLICT 匹配的唯一约束
+            self.logger.warning("barcode_scans.barcode_data 缺少唯一约束，改用查询后更新/插入")
+            self._upsert_supported = False
+            return None
+        
+        self.logger.error("条码记录写入失败: HTTP %d, 响应: %s", response.status_code, error_text)
+        self.logger.error("发送的数据: %s", scan_data)
+        return False
+    
+    def _status_fields(self, status: str, current_time: str) -> dict:
+        """根据状态生成对应的状态字段和时间字段"""
+        fields = _STATUS_FIELD_MAP.get(status)
+        if fields:
+            status_field, time_field = fields
+            return {status_field: True, time_field: current_time}
+        return {}
+    
     def _get_existing_record(self, barcode_data: str) -> dict:
         """获取现有记录"""
         try:
-            response = requests.get(
-                f"{self.api_url}/barcode_scans?barcode_data=eq.{barcode_data}",
-                headers=self.headers,
-                timeout=10
+            response = self.session.get(
+                self._scans_url,
+                # 只取更新所需的列，响应仅为 [{"id": N, "barcode_data": ...}]
+                params={'barcode_data': f'eq.{barcode_data}', 'select': 'id,barcode_data', 'limit': '1'},
+                timeout=self._timeout
             )
             
             if response.status_code == 200:
-                records = response.json()
+                records = _loads(response.content)
                 return records[0] if records else None
             else:
-                self.logger.error(f"查询现有记录失败: HTTP {response.status_code}")
+                self.logger.error("查询现有记录失败: HTTP %d", response.status_code)
                 return None
                 
         except Exception as e:
-            self.logger.error(f"查询现有记录失败: {e}")
+            self.logger.error("查询现有记录失败: %s", e)
             return None
     
     def _get_pacific_time(self) -> str:
         """获取本地时间，格式化为数据库兼容格式"""
-        # 直接使用本地时间，不进行时区转换
-        local_time = datetime.now()
-        
-        # 使用简单格式，不包含时区信息
-        formatted_time = local_time.strftime('%Y-%m-%d %H:%M:%S.%f')
-        
-        return formatted_time
+        # 直接使用本地时间，不进行时区转换；格式为 'YYYY-MM-DD HH:MM:SS.mmm'（毫秒，3位小数），不包含时区信息
+        return _local_time_str()
     
-    def _create_new_record(self, barcode_data: str, status: str, device_port: str) -> bool:
+    def _create_new_record(self, barcode_data: str, status: str, device_port: str,
+                           scan_time: str = None) -> bool:
         """创建新记录 - 兼容现有表结构"""
         try:
             # 使用本地时间存储到数据库
-            current_time = self._get_pacific_time()
+            current_time = scan_time or self._get_pacific_time()
             
             # 构建新记录数据 - 只使用存在的字段
             scan_data = {
@@ -186,58 +612,41 @@ class DatabaseManagerHTTP:
             }
             
             # 根据状态添加对应的状态字段
-            if status:
-                status_mapping = {
-                    '已排产': ('status_1_scheduled', 'status_1_time'),
-                    '已切割': ('status_2_cut', 'status_2_time'),
-                    '已清角': ('status_3_cleaned', 'status_3_time'),
-                    '已入库': ('status_4_stored', 'status_4_time'),
-                    '部分出库': ('status_5_partial_out', 'status_5_time'),
-                    '已出库': ('status_6_shipped', 'status_6_time')
-                }
-                
-                if status in status_mapping:
-                    status_field, time_field = status_mapping[status]
-                    scan_data[status_field] = True
-                    scan_data[time_field] = current_time
+            scan_data.update(self._status_fields(status, current_time))
             
-            self.logger.debug(f"尝试创建记录，数据: {scan_data}")
+            self.logger.debug("尝试创建记录，数据: %s", scan_data)
             
             # 执行插入
-            response = requests.post(
-                f"{self.api_url}/barcode_scans",
-                headers=self.headers,
-                json=scan_data,
-                timeout=10
+            response = self.session.post(
+                self._scans_url,
+                data=_dumps(scan_data),
+                timeout=self._timeout
             )
             
-            if response.status_code in [200, 201]:
-                self.logger.info(f"新条码记录创建成功: {barcode_data} (状态: {status}) [本地时间: {current_time}]")
-                # 同时保存到本地备份（如果启用）
-                if self.config['local_backup_enabled']:
-                    self._save_to_local(f"{self._get_status_prefix(status)}@{barcode_data}", device_port)
+            if response.status_code in _OK_WRITE:
+                self.logger.info("新条码记录创建成功: %s (状态: %s) [本地时间: %s]", barcode_data, status, current_time)
                 return True
             else:
                 # 记录详细的错误信息
-                error_text = response.text if hasattr(response, 'text') else 'Unknown error'
-                self.logger.error(f"新条码记录创建失败: HTTP {response.status_code}, 响应: {error_text}")
-                self.logger.error(f"发送的数据: {scan_data}")
-                
-                # 如果是400错误，可能是字段不存在，尝试只用基本字段重试
-                if response.status_code == 400:
-                    return self._create_basic_record(barcode_data, status, device_port)
-                
+                error_text = _error_text(response)
+                self.logger.error("新条码记录创建失败: HTTP %d, 响应: %s", response.status_code, error_text)
+                self.logger.error("发送的数据: %s", scan_data)
+                # 400 等客户端错误重试无效，直接返回失败，由调用方落入本地备份
                 return False
                 
+        except requests.RequestException:
+            # 网络异常（含重试耗尽）交由调用方处理，记录保留在本地等待同步
+            raise
         except Exception as e:
-            self.logger.error(f"创建新记录失败: {e}")
+            self.logger.error("创建新记录失败: %s", e)
             return False
 
-    def _update_existing_record(self, existing_record: dict, status: str, device_port: str) -> bool:
+    def _update_existing_record(self, existing_record: dict, status: str, device_port: str,
+                                scan_time: str = None) -> bool:
         """更新现有记录的状态 - 兼容现有表结构"""
         try:
             # 使用本地时间存储到数据库
-            current_time = self._get_pacific_time()
+            current_time = scan_time or self._get_pacific_time()
             
             # 构建更新数据 - 只使用存在的字段
             update_data = {
@@ -245,138 +654,652 @@ class DatabaseManagerHTTP:
             }
             
             # 根据状态添加对应的状态字段
-            if status:
-                status_mapping = {
-                    '已排产': ('status_1_scheduled', 'status_1_time'),
-                    '已切割': ('status_2_cut', 'status_2_time'),
-                    '已清角': ('status_3_cleaned', 'status_3_time'),
-                    '已入库': ('status_4_stored', 'status_4_time'),
-                    '部分出库': ('status_5_partial_out', 'status_5_time'),
-                    '已出库': ('status_6_shipped', 'status_6_time')
-                }
-                
-                if status in status_mapping:
-                    status_field, time_field = status_mapping[status]
-                    update_data[status_field] = True
-                    update_data[time_field] = current_time
+            update_data.update(self._status_fields(status, current_time))
             
-            self.logger.debug(f"尝试更新记录，数据: {update_data}")
+            self.logger.debug("尝试更新记录，数据: %s", update_data)
             
             # 执行更新
-            response = requests.patch(
-                f"{self.api_url}/barcode_scans?id=eq.{existing_record['id']}",
-                headers=self.headers,
-                json=update_data,
-                timeout=10
+            response = self.session.patch(
+                self._scans_url,
+                params={'id': f"eq.{existing_record['id']}"},
+                data=_dumps(update_data),
+                timeout=self._timeout
             )
             
-            if response.status_code in [200, 204]:
-                self.logger.info(f"条码状态更新成功: {existing_record['barcode_data']} -> {status} [本地时间: {current_time}]")
-                # 同时保存到本地备份（如果启用）
-                if self.config['local_backup_enabled']:
-                    self._save_to_local(f"{self._get_status_prefix(status)}@{existing_record['barcode_data']}", device_port)
+            if response.status_code in _OK_WRITE:
+                self.logger.info("条码状态更新成功: %s -> %s [本地时间: %s]",
+                                 existing_record['barcode_data'], status, current_time)
                 return True
             else:
-                error_text = response.text if hasattr(response, 'text') else 'Unknown error'
-                self.logger.error(f"条码状态更新失败: HTTP {response.status_code}, 响应: {error_text}")
-                self.logger.error(f"发送的数据: {update_data}")
+                error_text = _error_text(response)
+                self.logger.error("条码状态更新失败: HTTP %d, 响应: %s", response.status_code, error_text)
+                self.logger.error("发送的数据: %s", update_data)
                 return False
                 
+        except requests.RequestException:
+            raise
         except Exception as e:
-            self.logger.error(f"更新现有记录失败: {e}")
+            self.logger.error("更新现有记录失败: %s", e)
             return False
 
     def _get_status_prefix(self, status: str) -> str:
         """根据状态获取对应的前缀"""
-        status_prefix_mapping = {
-            '已排产': '0',
-            '已切割': '1',
-            '已清角': '2',
-            '已入库': '3',
-            '部分出库': '4',
-            '已出库': '5'
-        }
-        return status_prefix_mapping.get(status, '')
+        return _STATUS_PREFIX.get(status, '')
 
-    def _save_to_local(self, barcode_data: str, device_port: str) -> bool:
-        """保存数据到本地文件（备份/离线模式）"""
+    def _save_to_local(self, barcode_data: str, device_port: str, synced: bool = False) -> bool:
+        """
+        保存数据到本地文件（备份/离线模式）
+        
+        Args:
+            barcode_data: 条码数据（含状态前缀）
+            device_port: 设备端口
+            synced: 数据是否已上传到数据库（已上传的记录同步时会被跳过）
+        """
         if not self.config['local_backup_enabled']:
             return False
         
+        # 解析条码数据中的状态信息
+        clean_barcode_data, status = self._parse_barcode_status(barcode_data)
+        
+        # 使用本地时间
+        local_data = {
+            'barcode_data': clean_barcode_data,
+            'scan_time': self._get_pacific_time(),
+            'device_port': device_port,
+            'status': status
+        }
+        
+        if not self._save_records_to_local([local_data], synced):
+            return False
+        self.logger.info("扫描数据保存到本地: %s (状态: %s) [本地时间]", clean_barcode_data, status or '无')
+        return True
+    
+    def _save_records_to_local(self, records: List[dict], synced: bool = False) -> Optional[List[tuple]]:
+        """
+        把多条已解析的扫描记录一次追加写入当天本地备份文件
+        
+        Args:
+            records: 含 barcode_data/scan_time/device_port/status 的记录
+            synced: 数据是否已上传到数据库
+            
+        Returns:
+            每条记录的位置 [(文件路径, 行起始字节位置), ...]；未保存时返回 None
+        """
+        if not records or not self.config['local_backup_enabled']:
+            return None
+        
         try:
-            # 解析条码数据中的状态信息
-            clean_barcode_data, status = self._parse_barcode_status(barcode_data)
+            lines = [_dumps({**record, 'synced': synced}) + b'\n' for record in records]
+            # 追加写入当天文件（文件保持打开，写入后立即刷新到系统，避免程序崩溃时丢失）
+            with self._local_file_lock:
+                f = self._get_local_file()
+                offset = f.tell()
+                f.write(b''.join(lines))
+                f.flush()
+                self._local_file_dirty = True
+            
+            locations = []
+            for line in lines:
+                locations.append((f.name, offset))
+                offset += len(line)
+            return locations
             
-            # 使用本地时间
-            local_data = {
-                'barcode_data': clean_barcode_data,
-                'scan_time': self._get_pacific_time(),
-                'device_port': device_port,
-                'status': status,
-                'synced': False
+        except Exception as e:
+            self.logger.error("本地保存失败: %s", e)
+            return None
+
+    def get_scan_statistics(self) -> dict:
+        """
+        获取扫描统计信息（由数据库按状态聚合）
+        
+        Returns:
+            {'total_barcodes': 条码总数, 'status_counts': {状态: 数量}}
+        """
+        empty = {'total_barcodes': 0, 'status_counts': {}}
+        if not self.session or not self.config['database_enabled']:
+            return empty
+        
+        try:
+            response = self.session.get(
+                f"{self.api_url}/barcode_scan_status_counts?select=current_status,n",
+                timeout=self._timeout
+            )
+            if response.status_code == 200:
+                status_counts = {row['current_status']: row['n'] for row in _loads(response.content)}
+            else:
+                # 数据库未创建统计视图时退回客户端计数
+                self.logger.warning("统计视图不可用 (HTTP %s)，改为客户端计数", response.status_code)
+                status_counts = self._count_statuses_client_side()
+                if status_counts is None:
+                    return empty
+                total = self._count_rows('barcode_scans')
+                return {
+                    'total_barcodes': total if total is not None else sum(status_counts.values()),
+                    'status_counts': status_counts
+                }
+            
+            return {
+                'total_barcodes': sum(status_counts.values()),
+                'status_counts': status_counts
             }
             
+        except Exception as e:
+            self.logger.error("获取统计信息失败: %s", e)
+            return empty
+    
+    def _count_rows(self, table: str) -> Optional[int]:
+        """
+        用 HEAD 请求获取表的精确行数（从 Content-Range 响应头解析，不下载任何数据行）
+        
+        Returns:
+            行数；请求失败时返回 None
+        """
+        response = self.session.head(
+            f"{self.api_url}/{table}",
+            headers={'Prefer': 'count=exact', 'Range-Unit': 'items'},
+            timeout=self._timeout
+        )
+        content_range = response.headers.get('Content-Range', '')
+        if response.status_code not in _OK_READ or '/' not in content_range:
+            self.logger.error("获取 %s 行数失败: HTTP %s", table, response.status_code)
+            return None
+        count = content_range.rsplit('/', 1)[-1]
+        return int(count) if count.isdigit() else None
+    
+    def test_connection(self) -> bool:
+        """测试数据库连接（HEAD 请求，不传输数据行）"""
+        if not self.session or not self.config['database_enabled']:
+            return False
+        
+        try:
+            response = self.session.head(self._scans_url, params={'limit': '1'}, timeout=self._probe_timeout)
+            if response.status_code in _OK_READ:
+                return True
+            self.logger.error("数据库连接测试失败: HTTP %s", response.status_code)
+            return False
+        except Exception as e:
+            self.logger.error("数据库连接测试失败: %s", e)
+            return False
+    
+    def _count_statuses_client_side(self) -> Optional[dict]:
+        """下载所有记录的 current_status 并在本地计数（旧数据库的兼容路径）"""
+        response = self.session.get(f"{self.api_url}/barcode_scans?select=current_status", timeout=self._bulk_timeout)
+        if response.status_code != 200:
+            self.logger.error("获取统计信息失败: HTTP %s", response.status_code)
+            return None
+        
+        status_counts = {}
+        for record in _loads(response.content):
+            status = record.get('current_status')
+            status_counts[status] = status_counts.get(status, 0) + 1
+        return status_counts
+    
+    def _get_local_file(self):
+        """获取当天本地备份文件的追加句柄，过了零点时切换文件（调用方需持有 _local_file_lock）"""
+        # 平时只比较一次时间戳，文件名、目录检查只在打开新文件时进行
+        if self._local_file is None or time.time() >= self._local_file[0]:
+            self._close_local_file()
+            
+            # 生成文件名（按日期分组，使用本地日期）
+            now = datetime.now()
+            next_midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+            
             # 确保本地数据目录存在
             os.makedirs(self.local_data_dir, exist_ok=True)
+            filepath = os.path.join(self.local_data_dir, f"scans_{now:%Y-%m-%d}.jsonl")
+            self._local_file = (next_midnight.timestamp(), open(filepath, 'ab', buffering=64 * 1024))
+        return self._local_file[1]
+    
+    def _fsync_loop(self):
+        """后台落盘线程：每 fsync_interval 秒把当天备份文件的新写入同步到磁盘"""
+        while True:
+            time.sleep(self.config['fsync_interval'])
+            with self._local_file_lock:
+                self._fsync_local_file()
+    
+    def _fsync_local_file(self):
+        """把本地备份文件的新写入同步到磁盘（调用方需持有 _local_file_lock）"""
+        if self._local_file is None or not self._local_file_dirty:
+            return
+        try:
+            os.fsync(self._local_file[1].fileno())
+            self._local_file_dirty = False
+        except OSError as e:
+            self.logger.error("本地备份文件落盘失败: %s", e)
+    
+    def _close_local_file(self):
+        """关闭本地备份文件句柄（调用方需持有 _local_file_lock）"""
+        if self._local_file is not None:
+            self._fsync_local_file()
+            self._local_file[1].close()
+            self._local_file = None
+    
+    def close(self):
+        """上传队列中剩余的扫描，然后关闭本地备份文件和HTTP会话"""
+        self.flush()
+        with self._local_file_lock:
+            self._close_local_file()
+        if self.session is not None:
+            self.session.close()
+    
+    def sync_local_data(self) -> int:
+        """
+        同步本地未上传的扫描数据到数据库
+        
+        Returns:
+            同步成功的记录数量
+        """
+        if not self.session or not self.config['database_enabled']:
+            self.logger.warning("数据库不可用，无法同步本地数据")
+            return 0
+        
+        if not self.config['auto_sync_enabled']:
+            self.logger.info("自动同步已禁用")
+            return 0
+        
+        # scandir 的目录项自带文件类型，无需对每个文件额外 stat；按文件名（日期）顺序同步
+        try:
+            with os.scandir(self.local_data_dir) as entries:
+                backup_files = sorted(
+                    (entry.path, entry.stat().st_size) for entry in entries
+                    if entry.name.startswith('scans_') and entry.name.endswith('.jsonl') and entry.is_file()
+                )
+        except FileNotFoundError:
+            self.logger.info("没有找到本地备份数据")
+            return 0
+        
+        uploaded_count = 0
+        with self._sync_lock:
+            if self._sync_offsets is None:
+                self._sync_offsets = self._load_sync_offsets()
+            sync_offsets = dict(self._sync_offsets)
+            today_name = f"scans_{datetime.now():%Y-%m-%d}.jsonl"
             
-            # 生成文件名（按日期分组，使用本地日期）
-            local_date = datetime.now().strftime('%Y-%m-%d')
-            filename = f"scans_{local_date}.jsonl"
-            filepath = os.path.join(self.local_data_dir, filename)
+            for filepath, size in backup_files:
+                filename = os.path.basename(filepath)
+                start = sync_offsets.get(filename, 0)
+                # 进度之后没有新内容的文件无需读取（文件变小说明被替换，从头同步）
+                if start == size:
+                    continue
+                if start > size:
+                    start = 0
+                count, sync_offsets[filename] = self._sync_jsonl_file(filepath, start)
+                uploaded_count += count
+                
+                # 往日文件已全部处理时，同步进度已覆盖账本中的所有记录，账本不再需要
+                if sync_offsets[filename] == size and filename != today_name:
+                    self._remove_ledger(_ledger_path(filepath))
             
-            # 追加写入文件
-            with open(filepath, 'a', encoding='utf-8') as f:
-                f.write(json.dumps(local_data, ensure_ascii=False) + '\n')
+            if sync_offsets != self._sync_offsets:
+                self._save_sync_offsets(sync_offsets)
+                self._sync_offsets = sync_offsets
+        
+        if uploaded_count:
+            self.logger.info("本地数据同步完成: %s 条记录成功", uploaded_count)
+        else:
+            self.logger.debug("本地数据同步完成: 没有新同步的记录")
+        return uploaded_count
+    
+    def _sync_loop(self):
+        """后台自动同步线程：定期补传本地未同步的记录，网络异常时按指数退避延后重试"""
+        attempt = 0
+        delay = self.config['auto_sync_interval']
+        while True:
+            time.sleep(delay)
+            failures = self._sync_failures
+            try:
+                self.sync_local_data()
+            except Exception as e:
+                self.logger.error("自动同步失败: %s", e)
+                self._sync_failures += 1
             
-            self.logger.info(f"扫描数据保存到本地: {clean_barcode_data} (状态: {status or '无'}) [本地时间]")
+            if self._sync_failures > failures:
+                attempt += 1
+                delay = min(SYNC_BACKOFF_MAX, SYNC_BACKOFF_BASE * 2 ** attempt)
+                self.logger.warning("自动同步遇到网络异常，%s 秒后重试", delay)
+            else:
+                attempt = 0
+                delay = self.config['auto_sync_interval']
+    
+    def _build_sync_batches(self, pending: List[dict]) -> List[list]:
+        """
+        把待同步记录整理成批量 upsert 的批次
+        
+        同一批 upsert 中不能出现重复条码，因此先把同一条码的记录合并为一行（后扫描的覆盖先扫描的）；
+        PostgREST 批量写入要求每行字段相同，再按字段集合分组，每组按 SYNC_BATCH_SIZE 切分。
+        
+        Returns:
+            批次列表，每个元素为 [(合并后的行, 对应的本地记录列表), ...]
+        """
+        # 缺少扫描时间的记录统一使用本次同步开始的时间
+        fallback_time = self._get_pacific_time()
+        merged = {}
+        for record in pending:
+            barcode_data = record['barcode_data']
+            if barcode_data not in merged:
+                merged[barcode_data] = ({'barcode_data': barcode_data}, [])
+            row, members = merged[barcode_data]
+            row['device_port'] = record.get('device_port', 'unknown')
+            row.update(self._status_fields(record['status'], record.get('scan_time') or fallback_time))
+            members.append(record)
+        
+        if len(merged) < len(pending):
+            self.logger.debug("批次内合并重复条码: %d 条记录 -> %d 行", len(pending), len(merged))
+        
+        groups = {}
+        for row, members in merged.values():
+            groups.setdefault(tuple(sorted(row)), []).append((row, members))
+        
+        return [
+            items[i:i + SYNC_BATCH_SIZE]
+            for items in groups.values()
+            for i in range(0, len(items), SYNC_BATCH_SIZE)
+        ]
+    
+    def _sync_batch(self, items: list) -> tuple:
+        """
+        批量上传一个批次，失败时逐条上传以隔离被拒绝的记录
+        
+        Returns:
+            (上传成功的本地记录列表, 被服务器拒绝的本地记录列表)；网络异常的记录两者都不包含
+        """
+        rows = [row for row, _ in items]
+        result = None
+        if self._upsert_supported:
+            try:
+                result = self._upsert_batch(rows)
+            except Exception as e:
+                # 网络错误：整批保持未同步，下次重试
+                self.logger.error("批量同步失败，稍后重试: %s", e)
+                self._sync_failures += 1
+                return [], []
+        
+        if result:
+            return [record for _, members in items for record in members], []
+        
+        uploaded, rejected = [], []
+        for _, members in items:
+            for record in members:
+                result = self._sync_record(record)
+                if result:
+                    uploaded.append(record)
+                elif result is not None:
+                    rejected.append(record)
+        return uploaded, rejected
+    
+    def _upsert_batch(self, rows: List[dict]) -> Optional[bool]:
+        """
+        一次请求批量 upsert 多行（每行字段必须相同，且条码不重复）
+        
+        Returns:
+            是否成功；数据库缺少唯一约束时返回 None
+        """
+        body = _dumps(rows)
+        if self.config['gzip_requests'] and len(body) >= GZIP_MIN_BYTES:
+            # 批量 JSON 字段名高度重复，最快压缩级别即可大幅减少上行流量
+            response = self.session.post(
+                self._upsert_url,
+                headers=_UPSERT_GZIP_HEADERS,
+                data=gzip.compress(body, compresslevel=1),
+                timeout=self._bulk_timeout
+            )
+            if _rejects_gzip(response):
+                # 服务端不接受压缩请求体时关闭压缩，改发未压缩的请求；其他 4xx（约束、类型错误等）按普通失败处理
+                self.logger.warning("服务器不接受gzip请求体 (HTTP %s)，已关闭请求压缩", response.status_code)
+                self.config['gzip_requests'] = False
+                response = None
+        else:
+            response = None
+        
+        if response is None:
+            response = self.session.post(
+                self._upsert_url,
+                headers=_UPSERT_HEADERS,
+                data=body,
+                timeout=self._bulk_timeout
+            )
+        
+        if response.status_code in _OK_WRITE:
+            self.logger.info("批量同步成功: %d 个条码", len(rows))
             return True
-            
+        
+        error_text = _error_text(response)
+        if response.status_code == 400 and '42P10' in error_text:
+            self.logger.warning("barcode_scans.barcode_data 缺少唯一约束，改为逐条同步")
+            self._upsert_supported = False
+            return None
+        
+        self.logger.warning("批量同步失败，改为逐条同步: HTTP %s, 响应: %s", response.status_code, error_text)
+        return False
+    
+    def _sync_record(self, record: dict) -> Optional[bool]:
+        """
+        上传一条本地记录（使用原扫描时间，不再写入本地备份）
+        
+        Returns:
+            是否成功；网络异常（含重试耗尽）时返回 None
+        """
+        try:
+            return self._write_record(
+                record['barcode_data'],
+                record['status'],
+                record.get('device_port', 'unknown'),
+                record.get('scan_time')
+            )
+        except requests.RequestException as e:
+            self.logger.error("同步记录失败 %s: %s", record.get('barcode_data'), e)
+            self._sync_failures += 1
+            return None
         except Exception as e:
-            self.logger.error(f"本地保存失败: {e}")
+            self.logger.error("同步记录失败 %s: %s", record.get('barcode_data'), e)
             return False
 
-    def _sync_jsonl_file(self, filepath: str) -> int:
-        """同步单个JSONL文件"""
+    def _sync_jsonl_file(self, filepath: str, start: int = 0) -> tuple:
+        """
+        同步单个JSONL文件（未同步的记录合并为批量 upsert 并发上传）
+        
+        JSONL 文件只追加不重写；同步成功的记录以行起始字节位置追加到同名 .synced 账本文件中。
+        没有状态的记录无法上传，转入死信文件后同样记入账本。
+        文件从 start 位置逐行读取，每累积 SYNC_WINDOW_SIZE 条记录上传一次，内存占用与文件大小无关。
+        
+        Returns:
+            (同步成功的记录数量, 新的同步进度)：进度为第一条仍未同步的记录位置，全部完成时为已读取的末尾
+        """
         uploaded_count = 0
+        first_unsynced = None
+        ledger_path = _ledger_path(filepath)
+        position = start
         
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            
-            unsynced_lines = []
+            synced_offsets = self._load_ledger(ledger_path)
+            pending = []
+            offsets = {}
+            no_status = {}  # 行起始位置 -> 没有状态的记录
             
-            for line in lines:
-                try:
-                    record = json.loads(line.strip())
-                    if not record.get('synced', False):
-                        # 尝试上传
-                        barcode_with_status = f"{self._get_status_prefix(record.get('status', ''))}@{record['barcode_data']}"
-                        if self.upload_scan_data(barcode_with_status, record.get('device_port', 'unknown')):
-                            record['synced'] = True
-                            record['sync_time'] = self._get_pacific_time()
-                            uploaded_count += 1
+            with open(filepath, 'rb') as f:
+                f.seek(start)
+                for line in f:
+                    offset = position
+                    position += len(line)
+                    # 最后一行可能仍在写入，留到下次同步
+                    if not line.endswith(b'\n'):
+                        position = offset
+                        break
+                    if offset in synced_offsets:
+                        continue
+                    try:
+                        record = _loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if not isinstance(record, dict) or 'barcode_data' not in record:
+                        continue
+                    if record.get('synced', False):
+                        continue
                     
-                    unsynced_lines.append(json.dumps(record, ensure_ascii=False))
+                    # 没有状态的记录无法写入状态字段，转入死信文件（写入失败时进度停在该记录，下次重试）
+                    if not record.get('status'):
+                        no_status[offset] = record
+                        if len(no_status) >= SYNC_WINDOW_SIZE:
+                            first_unsynced = self._dead_letter_no_status(no_status, ledger_path, first_unsynced)
+                            no_status = {}
+                        continue
                     
-                except json.JSONDecodeError:
-                    # 保留无法解析的行
-                    unsynced_lines.append(line.strip())
+                    pending.append(record)
+                    offsets[id(record)] = offset
+                    if len(pending) >= SYNC_WINDOW_SIZE:
+                        uploaded_count, first_unsynced = self._sync_window(
+                            pending, offsets, ledger_path, uploaded_count, first_unsynced)
+                        pending = []
+                        offsets = {}
             
-            # 重写文件
-            with open(filepath, 'w', encoding='utf-8') as f:
-                for line in unsynced_lines:
-                    f.write(line + '\n')
+            if pending:
+                uploaded_count, first_unsynced = self._sync_window(
+                    pending, offsets, ledger_path, uploaded_count, first_unsynced)
+            if no_status:
+                first_unsynced = self._dead_letter_no_status(no_status, ledger_path, first_unsynced)
                     
         except Exception as e:
-            self.logger.error(f"同步文件失败 {filepath}: {e}")
+            self.logger.error("同步文件失败 %s: %s", filepath, e)
+            return uploaded_count, start
         
-        return uploaded_count
+        return uploaded_count, position if first_unsynced is None else first_unsynced
+    
+    def _dead_letter_no_status(self, records: dict, ledger_path: str, first_unsynced: Optional[int]) -> Optional[int]:
+        """把没有状态的记录（行起始位置 -> 记录）转入死信文件并记入账本，返回更新后的第一条未同步记录位置"""
+        if self._dead_letter(list(records.values()), reason='没有状态'):
+            self._append_ledger(ledger_path, list(records))
+            return first_unsynced
+        earliest = min(records)
+        return earliest if first_unsynced is None else min(first_unsynced, earliest)
+    
+    def _sync_window(self, pending: List[dict], offsets: dict, ledger_path: str,
+                     uploaded_count: int, first_unsynced: Optional[int]) -> tuple:
+        """上传一批待同步记录，返回累计的 (同步成功数量, 第一条未同步记录的位置)"""
+        uploaded = set(self._sync_pending(pending, offsets, ledger_path))
+        failed = [offset for offset in offsets.values() if offset not in uploaded]
+        if failed and first_unsynced is None:
+            first_unsynced = min(failed)
+        return uploaded_count + len(uploaded), first_unsynced
+    
+    def _sync_pending(self, pending: List[dict], offsets: dict, ledger_path: str) -> List[int]:
+        """
+        上传一批待同步记录，并把成功记录的行起始位置追加到账本
+        
+        Returns:
+            同步成功的记录的行起始位置
+        """
+        # 多个批次共用会话连接池并发上传
+        with ThreadPoolExecutor(max_workers=SYNC_MAX_WORKERS) as executor:
+            results = list(executor.map(self._sync_batch, self._build_sync_batches(pending)))
+        
+        new_offsets = [offsets[id(record)] for uploaded, _ in results for record in uploaded]
+        # 被服务器拒绝的记录转入死信文件，同样记入账本，不再反复重试
+        rejected = [record for _, batch_rejected in results for record in batch_rejected]
+        if self._dead_letter(rejected):
+            self._append_ledger(ledger_path, new_offsets + [offsets[id(record)] for record in rejected])
+        else:
+            self._append_ledger(ledger_path, new_offsets)
+        return new_offsets
+    
+    def _dead_letter(self, records: List[dict], reason: str = '被服务器拒绝') -> bool:
+        """把无法同步的记录（默认：被服务器拒绝且重试无效）追加到死信文件，供人工处理；返回是否写入成功"""
+        if not records:
+            return False
+        dead_letter_time = self._get_pacific_time()
+        data = b''.join(_dumps({**record, 'dead_letter_time': dead_letter_time}) + b'\n' for record in records)
+        try:
+            os.makedirs(self.local_data_dir, exist_ok=True)
+            with self._ledger_lock:
+                with open(os.path.join(self.local_data_dir, DEAD_LETTER_FILENAME), 'ab') as f:
+                    f.write(data)
+                self.stats['dead_letter'] += len(records)
+            self.logger.error("%s 条记录%s，已转入 %s", len(records), reason, DEAD_LETTER_FILENAME)
+            return True
+        except OSError as e:
+            self.logger.error("写入死信文件失败: %s", e)
+            return False
+    
+    def _append_ledger(self, ledger_path: str, offsets: List[int]):
+        """把已同步记录的行起始位置一次追加写入账本"""
+        if not offsets:
+            return
+        data = ''.join(f"{offset}\n" for offset in sorted(offsets)).encode('ascii')
+        with self._ledger_lock:
+            with open(ledger_path, 'ab') as f:
+                f.write(data)
+    
+    def _remove_ledger(self, ledger_path: str):
+        """删除已被同步进度覆盖的账本文件"""
+        with self._ledger_lock:
+            try:
+                os.remove(ledger_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.logger.warning("删除同步账本失败 %s: %s", ledger_path, e)
+    
+    def _load_sync_offsets(self) -> Dict[str, int]:
+        """读取各备份文件的同步进度"""
+        offsets_path = os.path.join(self.local_data_dir, SYNC_OFFSETS_FILENAME)
+        try:
+            with open(offsets_path, 'rb') as f:
+                offsets = _loads(f.read())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        return offsets if isinstance(offsets, dict) else {}
+    
+    def _save_sync_offsets(self, offsets: Dict[str, int]):
+        """保存同步进度（先写临时文件再替换，避免中途退出留下半个文件）"""
+        offsets_path = os.path.join(self.local_data_dir, SYNC_OFFSETS_FILENAME)
+        tmp_path = offsets_path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(_dumps(offsets))
+            os.replace(tmp_path, offsets_path)
+        except OSError as e:
+            self.logger.error("保存同步进度失败: %s", e)
+    
+    def _load_ledger(self, ledger_path: str) -> set:
+        """读取同步账本中已同步记录的行起始位置"""
+        synced_offsets = set()
+        try:
+            with open(ledger_path, 'rb') as f:
+                for line in f:
+                    # 未写完整的最后一行（程序中途退出）忽略
+                    if line.endswith(b'\n') and line.strip().isdigit():
+                        synced_offsets.add(int(line))
+        except FileNotFoundError:
+            pass
+        return synced_offsets
 
 
 # 在文件末尾添加全局函数，保持与主程序的兼容性
 
-# 创建全局数据库管理器实例
-_db_manager = DatabaseManagerHTTP()
+# 全局数据库管理器实例，首次使用时创建（导入模块时不建立会话、不启动后台线程）
+_db_manager = None
+_db_manager_lock = threading.Lock()
+
+def _get_db() -> DatabaseManagerHTTP:
+    """获取全局数据库管理器，首次调用时创建"""
+    global _db_manager
+    if _db_manager is None:
+        with _db_manager_lock:
+            if _db_manager is None:
+                _db_manager = DatabaseManagerHTTP()
+    return _db_manager
+
+def __getattr__(name: str):
+    """db_manager 为与原版模块一致的别名，访问时才创建管理器"""
+    if name == 'db_manager':
+        return _get_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _close_at_exit():
+    """程序退出前上传排队中的扫描并关闭文件和会话"""
+    if _db_manager is not None:
+        _db_manager.close()
+
+atexit.register(_close_at_exit)
 
 def upload_scan_data(barcode_data: str, device_port: str) -> bool:
     """
@@ -390,7 +1313,7 @@ def upload_scan_data(barcode_data: str, device_port: str) -> bool:
     Returns:
         上传是否成功
     """
-    return _db_manager.upload_scan_data(barcode_data, device_port)
+    return _get_db().upload_scan_data(barcode_data, device_port)
 
 def upload_barcode_scan(barcode_data: str, device_port: str) -> bool:
     """
@@ -404,7 +1327,7 @@ def upload_barcode_scan(barcode_data: str, device_port: str) -> bool:
     Returns:
         上传是否成功
     """
-    return _db_manager.upload_scan_data(barcode_data, device_port)
+    return _get_db().upload_scan_data(barcode_data, device_port)
 
 def sync_local_data() -> int:
     """
@@ -414,7 +1337,7 @@ def sync_local_data() -> int:
     Returns:
         同步的记录数量
     """
-    return _db_manager.sync_local_data()
+    return _get_db().sync_local_data()
 
 def get_scan_statistics() -> dict:
     """
@@ -424,8 +1347,8 @@ def get_scan_statistics() -> dict:
     Returns:
         统计信息字典
     """
-    return _db_manager.get_scan_statistics()
+    return _get_db().get_scan_statistics()
 
 def test_database_connection() -> bool:
     """测试数据库连接"""
-    return _db_manager.test_connection()
\ No newline at end of file
+    return _get_db().test_connection()
\ No newline at end of file
@@ -15,6 +15,33 @@ CREATE INDEX IF NOT EXISTS idx_barcode_scans_scan_time ON barcode_scans(scan_tim
 CREATE INDEX IF NOT EXISTS idx_barcode_scans_barcode_data ON barcode_scans(barcode_data);
 CREATE INDEX IF NOT EXISTS idx_barcode_scans_device_port ON barcode_scans(device_port);
 
+-- 不重复条码数（供客户端统计调用，避免拉取全部条码）
+CREATE OR REPLACE FUNCTION count_distinct_barcodes()
+RETURNS INTEGER AS $$
+    SELECT COUNT(DISTINCT barcode_data)::INTEGER FROM barcode_scans;
+$$ LANGUAGE sql STABLE;
+
+-- 按条码前缀回填 status 为空的记录，返回更新的行数
+-- （供 update_existing_status.py 调用，一条语句完成全部更新；需要表中已有 status 列）
+CREATE OR REPLACE FUNCTION backfill_barcode_status()
+RETURNS INTEGER AS $$
+DECLARE
+    updated_count INTEGER;
+BEGIN
+    UPDATE barcode_scans
+    SET status = CASE LEFT(barcode_data, 2)
+        WHEN '1@' THEN '已切割'
+        WHEN '2@' THEN '已清角'
+        WHEN '3@' THEN '已入库'
+    END
+    WHERE status IS NULL
+      AND LEFT(barcode_data, 2) IN ('1@', '2@', '3@');
+    
+    GET DIAGNOSTICS updated_count = ROW_COUNT;
+    RETURN updated_count;
+END;
+$$ LANGUAGE plpgsql;
+
 
 
 
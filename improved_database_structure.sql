@@ -87,6 +87,10 @@ CREATE INDEX IF NOT EXISTS idx_barcode_scans_current_status ON barcode_scans(cur
 CREATE INDEX IF NOT EXISTS idx_barcode_scans_last_scan_time ON barcode_scans(last_scan_time);
 CREATE INDEX IF NOT EXISTS idx_barcode_scans_device_port ON barcode_scans(device_port);
 
+-- barcode_data 唯一约束是客户端 upsert（on_conflict=barcode_data）的前提；
+-- 旧表如果缺少该约束，可在清理重复条码后执行：
+-- ALTER TABLE barcode_scans ADD CONSTRAINT barcode_scans_barcode_data_key UNIQUE (barcode_data);
+
 -- 创建更新时间的触发器
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
@@ -101,6 +105,14 @@ CREATE TRIGGER update_barcode_scans_updated_at
     FOR EACH ROW 
     EXECUTE FUNCTION update_updated_at_column();
 
+-- 各状态数量统计视图（客户端统计只需读取每个状态一行）
+CREATE OR REPLACE VIEW barcode_scan_status_counts AS
+SELECT
+    current_status,
+    COUNT(*) AS n
+FROM barcode_scans
+GROUP BY current_status;
+
 -- ===================
 -- 示例查询
 -- ===================
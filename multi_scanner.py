@@ -7,14 +7,19 @@
 
 import serial
 import serial.tools.list_ports
+import serial.threaded
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
 import threading
 import time
 import json
 import os
-from datetime import datetime
+import queue
+import re
+from datetime import datetime, timedelta
 import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import winsound  # Windows系统声音播放
 from tkinter import font
 
@@ -35,11 +40,104 @@ except Exception as e:
         print(f"⚠️ 数据库模块加载失败: {e2}")
         print("程序将以离线模式运行，数据将保存到本地文件")
 
+# 扫描线程的串口读超时（秒）与驱动接收缓冲区大小（仅Windows驱动支持设置）
+# 读操作在驱动中阻塞等待数据，停止扫描时通过 cancel_read 立即唤醒，超时只是兜底
+SERIAL_READ_TIMEOUT = 0.5
+SERIAL_RX_BUFFER_SIZE = 8192
+
+# 帧内需要剔除的控制字符（保留 \t，以及 GS1 条码中作为分隔符的 0x1C-0x1F）
+_FRAME_STRIP = bytes(range(0, 9)) + bytes(range(11, 13)) + bytes(range(14, 0x1c)) + b'\x7f'
+
+# 设备配置中的校验位/停止位到 pyserial 常量的映射
+_PARITY_MAP = {
+    'N': serial.PARITY_NONE,
+    'E': serial.PARITY_EVEN,
+    'O': serial.PARITY_ODD,
+    'M': serial.PARITY_MARK,
+    'S': serial.PARITY_SPACE
+}
+
+_STOPBITS_MAP = {
+    1.0: serial.STOPBITS_ONE,
+    1.5: serial.STOPBITS_ONE_POINT_FIVE,
+    2.0: serial.STOPBITS_TWO
+}
+
+# 影响 get_serial_params 结果的配置属性，修改其中任意一个都会使缓存失效
+_SERIAL_CONFIG_ATTRS = frozenset({'baudrate', 'databits', 'parity', 'stopbits', 'timeout'})
+
+# 日志区刷新：待显示日志最多缓存的行数、刷新间隔（约30Hz）、文本框保留的最大行数
+LOG_QUEUE_MAX = 5000
+LOG_FLUSH_INTERVAL_MS = 33
+LOG_MAX_LINES = 2000
+
+# 需要触发自动重连的串口错误（连接断开、被占用、设备拔出等）
+_CONN_ERR_RE = re.compile(
+    r'device attached to the system is not functioning|permission|access|'
+    r'device not found|could not open port|serial exception',
+    re.IGNORECASE
+)
+
+# 设备列表与状态栏的合并刷新间隔（毫秒），期间的多次刷新请求只执行一次
+UI_REFRESH_INTERVAL_MS = 100
+
+# 端口枚举结果的缓存时间（秒），期间重复点击"刷新端口"直接使用缓存
+PORTS_CACHE_TTL = 1.0
+
+# 待上传扫描的队列上限（满时丢弃最旧的一条并记录日志）
+UPLOAD_QUEUE_MAX = 10000
+
+# 关闭程序时等待本地数据同步的最长时间（秒），超时后不再等待，剩余数据下次启动再同步
+SHUTDOWN_SYNC_TIMEOUT = 5.0
+
+# 扫描时间字符串缓存 (秒级时间戳, 'YYYY-mm-dd HH:MM:SS', 'HH:MM:SS')，同一秒内的扫描复用
+_scan_time_cache = (0, '', '')
+
+
+def scan_time_strs():
+    """返回当前时间的 (完整时间, 时分秒) 字符串，按秒缓存"""
+    global _scan_time_cache
+    now_s = int(time.time())
+    cache = _scan_time_cache
+    if now_s != cache[0]:
+        full = datetime.fromtimestamp(now_s).strftime('%Y-%m-%d %H:%M:%S')
+        cache = (now_s, full, full[11:])
+        _scan_time_cache = cache
+    return cache[1], cache[2]
+
+
+# 非ASCII扫描数据依次尝试的编码
+SCAN_ENCODINGS = ('utf-8', 'gbk')
+
+
+def decode_scan_frame(frame, preferred='utf-8'):
+    """
+    解码一帧完整的扫描数据
+    
+    纯ASCII直接解码；否则先尝试 preferred，再依次尝试 SCAN_ENCODINGS，都失败时按 ascii 忽略错误。
+    返回 (文本, 成功使用的编码)，调用方可记住该编码供下一帧优先使用。
+    """
+    if frame.isascii():
+        return frame.decode('ascii'), preferred  # 绝大多数条码为纯ASCII，无需尝试多种编码
+    try:
+        return frame.decode(preferred), preferred
+    except UnicodeDecodeError:
+        pass
+    for encoding in SCAN_ENCODINGS:
+        if encoding == preferred:
+            continue
+        try:
+            return frame.decode(encoding), encoding
+        except UnicodeDecodeError:
+            pass
+    return frame.decode('ascii', errors='ignore'), preferred
+
 
 class ScannerDevice:
     """单个扫码设备类"""
     
     def __init__(self, device_id, port, baudrate=9600, databits=8, parity='N', stopbits=1.0, timeout=1.0):
+        self._cached_params = None
         self.device_id = device_id
         self.port = port
         self.baudrate = baudrate
@@ -54,6 +152,8 @@ class ScannerDevice:
         self.scan_thread = None
         self.scan_count = 0
         self.last_scan_time = None
+        self._rx_buf = bytearray()  # 未凑满一帧的原始字节
+        self.frame_encoding = SCAN_ENCODINGS[0]  # 最近一次成功解码非ASCII数据的编码
         self.device_name = f"设备{device_id}({port})"
         
 
@@ -64,32 +164,28 @@ class ScannerDevice:
         self.last_error_time = None
         
         # 重复扫描检测
-        self.recent_scans = {}  # {data: timestamp}
+        self._recent_deque = deque()  # [(monotonic纳秒, data)]，按时间先后排列
+        self._recent_set = set()  # 窗口内仍有效的 data
         self.duplicate_window = 5.0  # 5秒内的重复扫描将被过滤
+        self._window_ns = int(self.duplicate_window * 1_000_000_000)
+    
+    def __setattr__(self, name, value):
+        # 串口配置变化时丢弃已缓存的连接参数
+        if name in _SERIAL_CONFIG_ATTRS:
+            object.__setattr__(self, '_cached_params', None)
+        object.__setattr__(self, name, value)
     
     def get_serial_params(self):
-        """获取串口参数"""
-        parity_map = {
-            'N': serial.PARITY_NONE,
-            'E': serial.PARITY_EVEN,
-            'O': serial.PARITY_ODD,
-            'M': serial.PARITY_MARK,
-            'S': serial.PARITY_SPACE
-        }
-        
-        stopbits_map = {
-            1.0: serial.STOPBITS_ONE,
-            1.5: serial.STOPBITS_ONE_POINT_FIVE,
-            2.0: serial.STOPBITS_TWO
-        }
-        
-        return {
-            'baudrate': self.baudrate,
-            'bytesize': self.databits,
-            'parity': parity_map.get(self.parity, serial.PARITY_NONE),
-            'stopbits': stopbits_map.get(self.stopbits, serial.STOPBITS_ONE),
-            'timeout': self.timeout
-        }
+        """获取串口参数（结果缓存到配置变化为止，调用方不应修改返回的字典）"""
+        if self._cached_params is None:
+            self._cached_params = {
+                'baudrate': self.baudrate,
+                'bytesize': self.databits,
+                'parity': _PARITY_MAP.get(self.parity, serial.PARITY_NONE),
+                'stopbits': _STOPBITS_MAP.get(self.stopbits, serial.STOPBITS_ONE),
+                'timeout': self.timeout
+            }
+        return self._cached_params
     
     def get_device_settings_dict(self):
         """获取设备设置字典"""
@@ -104,26 +200,68 @@ class ScannerDevice:
 
     def is_duplicate_scan(self, data):
         """检查是否为重复扫描"""
-        current_time = time.time()
-        
-        # 清理过期的扫描记录
-        expired_keys = []
-        for scan_data, timestamp in self.recent_scans.items():
-            if current_time - timestamp > self.duplicate_window:
-                expired_keys.append(scan_data)
+        now = time.monotonic_ns()
         
-        for key in expired_keys:
-            del self.recent_scans[key]
+        # 从队头清理过期的扫描记录（队列按时间有序，遇到未过期的即可停止）
+        recent = self._recent_deque
+        window_ns = self._window_ns
+        while recent and now - recent[0][0] > window_ns:
+            _, expired = recent.popleft()
+            self._recent_set.discard(expired)
         
         # 检查当前扫描是否重复
-        if data in self.recent_scans:
+        if data in self._recent_set:
             return True
         
         # 记录新的扫描
-        self.recent_scans[data] = current_time
+        recent.append((now, data))
+        self._recent_set.add(data)
         return False
 
 
+class BarcodeProtocol(serial.threaded.Protocol):
+    """扫码枪串口协议：在 ReaderThread 线程中按 CR/LF 拼帧，把完整条码交给主程序处理"""
+    
+    def __init__(self, app, device):
+        self.app = app
+        self.device = device
+    
+    def connection_made(self, transport):
+        # 复用设备已有的缓冲区，重连时只清空不重新分配
+        self.device._rx_buf.clear()
+    
+    def data_received(self, data):
+        # 按原始字节拼帧，完整一帧后再解码，避免多字节字符被拆在两次读取之间导致解码错误
+        device = self.device
+        rx_buf = device._rx_buf
+        rx_buf += data
+        
+        # 按 CR/LF 切出完整帧（CRLF 之间的空帧直接跳过）；用偏移量遍历，
+        # 本批数据处理完后再一次性删掉已消费的前缀，避免每帧都搬移剩余字节
+        pos = 0
+        while True:
+            cr = rx_buf.find(b'\r', pos)
+            lf = rx_buf.find(b'\n', pos)
+            if cr < 0 and lf < 0:
+                break
+            idx = lf if cr < 0 else cr if lf < 0 else min(cr, lf)
+            frame = rx_buf[pos:idx].translate(None, _FRAME_STRIP)
+            pos = idx + 1
+            
+            line, device.frame_encoding = decode_scan_frame(frame, device.frame_encoding)
+            line = line.strip()
+            if line:
+                self.app.process_scanned_data(device, line)
+        if pos:
+            del rx_buf[:pos]
+    
+    def connection_lost(self, exc):
+        # 主动停止扫描时 exc 为 None；读取出错或处理异常时交给界面线程处理
+        if exc is not None:
+            error_msg = str(exc)
+            self.app.root.after(0, lambda: self.app.handle_scan_error(self.device, error_msg))
+
+
 class MultiScannerApp:
     """多设备扫码程序主类"""
     
@@ -133,7 +271,13 @@ class MultiScannerApp:
         self.root.geometry("1100x700")
         self.root.minsize(950, 600)
         
-        # 在初始化时清理可能的孤立串口连接
+        # 待显示的日志行，由 _flush_log 定时批量写入文本框（界面创建前的日志也会保留）
+        self._log_q = deque(maxlen=LOG_QUEUE_MAX)
+        
+        # 串口枚举结果缓存 (monotonic时间, 端口信息列表)，启动时多处需要端口列表，只枚举一次
+        self._ports_cache = (float('-inf'), [])
+        
+        # 在初始化时检查可用串口
         self.cleanup_orphaned_serial_connections()
         
         # 设置现代化主题
@@ -141,6 +285,14 @@ class MultiScannerApp:
         
         # 设备管理
         self.devices = {}  # device_id -> ScannerDevice
+        self._ports_in_use = {}  # port -> device_id，与 self.devices 同步维护
+        self._port_by_label = {}  # 端口下拉框显示文本 -> port
+        self._ports_cache_time = 0.0  # 上次枚举端口的 monotonic 时间
+        self._ports_refreshing = False  # 后台枚举是否正在进行
+        self._row_cache = {}  # device_id -> 该行上次显示的各列值（行 iid 即 str(device_id)）
+        self._ui_pending = False  # 是否已安排合并刷新
+        self._ui_full_dirty = False  # 是否需要完整刷新设备列表与状态栏
+        self._ui_dirty_devices = {}  # 只需更新扫描计数的设备：device_id -> ScannerDevice
         self.next_device_id = 1
         self.total_scan_count = 0
         
@@ -149,10 +301,25 @@ class MultiScannerApp:
         
         # 当天扫描数据缓存（用于去重）
         self.today_scanned_data = set()
-        self.today_cache_file = f"today_scans_{datetime.now().strftime('%Y%m%d')}.json"
+        # 当天扫描缓存为追加写的文本日志（每行一个条码），启动时压缩去重
+        self.today_cache_file = f"today_scans_{datetime.now().strftime('%Y%m%d')}.ndjson"
+        self._today_fd = None
+        self._today_log_lines = 0  # 缓存文件中的行数，大于集合大小说明有重复行需要压缩
+        # 下一个零点的时间戳：程序跨天运行时在此之后切换到新一天的缓存，前一天的集合随之释放
+        self._today_rollover_ts = self._next_midnight_ts()
+        self._today_lock = threading.Lock()  # 保护去重集合与追加句柄：扫描线程写入、零点切换、清空缓存互斥
+        
+        # 自动重连：退避等待由 root.after 计时，只有真正的连接尝试在该线程池中执行
+        self._reconnect_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='reconnect')
         
         # 声音提示设置
         self.sound_enabled = tk.BooleanVar(value=True)
+        # 扫描线程不能读取 Tk 变量，这里保存一份普通布尔值，随复选框变化同步
+        self._sound_on = True
+        self.sound_enabled.trace_add('write', self._on_sound_enabled_changed)
+        # 提示音在单个后台线程播放；上一声未结束时新的提示音直接丢弃，避免连扫时积压
+        self._beep_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='beep')
+        self._beep_busy = threading.Event()
         
         # 自动连接设置
         self.auto_connect_enabled = tk.BooleanVar(value=False)
@@ -165,11 +332,24 @@ class MultiScannerApp:
         
         # 创建界面
         self.create_widgets()
+        self.root.after(LOG_FLUSH_INTERVAL_MS, self._flush_log)
+        self._tick_clock()
+        
+        # 数据库状态栏与连接测试函数（离线模式下没有状态栏，设置操作为空操作）
+        self._set_db_status = self.db_status_var.set if DATABASE_AVAILABLE else (lambda _s: None)
+        self._db_test = getattr(db, 'test_database_connection', None) if DATABASE_AVAILABLE else None
         
         # 数据库状态检查
         if DATABASE_AVAILABLE:
             self.check_database_status()
         
+        # 扫描数据由单个后台线程依次交给数据库模块，不再每次扫描新建线程
+        self._upload_q = queue.Queue(maxsize=UPLOAD_QUEUE_MAX)
+        self._upload_thread = None
+        if DATABASE_AVAILABLE:
+            self._upload_thread = threading.Thread(target=self._upload_loop, name='db-upload', daemon=True)
+            self._upload_thread.start()
+        
         # 刷新可用端口
         self.refresh_ports()
         
@@ -519,54 +699,80 @@ class MultiScannerApp:
         # 时间显示
         ttk.Separator(status_content, orient='vertical').grid(row=0, column=7, sticky=(tk.N, tk.S), padx=15)
         
-        self.time_var = tk.StringVar(value="🕐 " + datetime.now().strftime("%H:%M:%S"))
+        self.time_var = tk.StringVar(value="🕐 " + datetime.now().strftime("%H:%M"))
         time_label = ttk.Label(status_content, textvariable=self.time_var, style='Status.TLabel')
         time_label.grid(row=0, column=8, sticky=tk.E)
     
     def check_database_status(self):
         """检查数据库状态"""
         try:
-            import os
             url = os.getenv('SUPABASE_URL')
             key = os.getenv('SUPABASE_KEY')
             
             if url and key and url != "https://your-project-id.supabase.co":
                 # 测试实际的数据库连接
-                if DATABASE_AVAILABLE and hasattr(db, 'test_database_connection'):
+                if self._db_test is not None:
                     try:
-                        if db.test_database_connection():
+                        if self._db_test():
                             self.add_log("✅ 数据库连接测试成功，扫描数据将自动上传到云端")
-                            if hasattr(self, 'db_status_var'):
-                                self.db_status_var.set("数据库: ✅ 已连接")
+                            self._set_db_status("数据库: ✅ 已连接")
                         else:
                             self.add_log("⚠️ 数据库连接测试失败，数据将保存到本地并稍后同步")
-                            if hasattr(self, 'db_status_var'):
-                                self.db_status_var.set("数据库: ⚠️ 离线模式")
+                            self._set_db_status("数据库: ⚠️ 离线模式")
                     except Exception as test_e:
                         self.add_log(f"⚠️ 数据库连接测试异常: {test_e}")
-                        if hasattr(self, 'db_status_var'):
-                            self.db_status_var.set("数据库: ⚠️ 离线模式")
+                        self._set_db_status("数据库: ⚠️ 离线模式")
                 else:
                     self.add_log("✅ 数据库配置已加载，扫描数据将自动上传到云端")
-                    if hasattr(self, 'db_status_var'):
-                        self.db_status_var.set("数据库: ✅ 已连接")
+                    self._set_db_status("数据库: ✅ 已连接")
             else:
                 self.add_log("⚠️ 数据库配置不完整，数据将只保存在本地")
-                if hasattr(self, 'db_status_var'):
-                    self.db_status_var.set("数据库: ⚠️ 离线模式")
+                self._set_db_status("数据库: ⚠️ 离线模式")
         except Exception as e:
             self.add_log(f"⚠️ 数据库状态检查失败: {e}")
-            if hasattr(self, 'db_status_var'):
-                self.db_status_var.set("数据库: ❌ 错误")
+            self._set_db_status("数据库: ❌ 错误")
     
     def refresh_ports(self):
-        """刷新可用端口"""
-        ports = serial.tools.list_ports.comports()
-        port_list = []
-        
-        for port in ports:
-            port_info = f"{port.device} - {port.description}"
-            port_list.append(port_info)
+        """刷新可用端口（在后台线程枚举，结果缓存 PORTS_CACHE_TTL 秒）"""
+        if time.monotonic() - self._ports_cache_time < PORTS_CACHE_TTL:
+            self._apply_ports(self._port_by_label)
+            return
+        if self._ports_refreshing:
+            return
+        self._ports_refreshing = True
+        threading.Thread(target=self._enumerate_ports_bg, daemon=True).start()
+    
+    def _list_ports(self, ttl=2.0):
+        """返回 comports() 的结果，ttl 秒内重复调用直接使用缓存（Windows 上枚举需要遍历设备树）"""
+        cached_at, ports = self._ports_cache
+        now = time.monotonic()
+        if now - cached_at >= ttl:
+            ports = list(serial.tools.list_ports.comports())
+            self._ports_cache = (now, ports)
+        return ports
+    
+    def _enumerate_ports_bg(self):
+        """后台枚举串口（Windows 上需要读取注册表，耗时较长），完成后回到界面线程更新"""
+        try:
+            ports = self._list_ports(PORTS_CACHE_TTL)
+            # 显示文本与端口名的对应关系在这里一次建好，添加设备时直接查表
+            port_map = {f"{port.device} - {port.description}": port.device for port in ports}
+        except Exception as e:
+            error_msg = str(e)
+            self.root.after(0, lambda: self._apply_ports(None, error_msg))
+            return
+        self.root.after(0, lambda: self._apply_ports(port_map))
+    
+    def _apply_ports(self, port_map, error_msg=None):
+        """用枚举结果更新端口下拉框"""
+        self._ports_refreshing = False
+        if port_map is None:
+            self.add_log(f"⚠️ 枚举串口失败: {error_msg}")
+            return
+        if port_map is not self._port_by_label:
+            self._port_by_label = port_map
+            self._ports_cache_time = time.monotonic()
+        port_list = list(port_map)
         
         self.port_combo['values'] = port_list
         if port_list and not self.port_combo.get():
@@ -581,13 +787,12 @@ class MultiScannerApp:
             messagebox.showerror("错误", "请选择一个COM端口")
             return
         
-        port = selection.split(" - ")[0]
+        port = self._port_by_label.get(selection) or selection.split(" - ")[0]
         
         # 检查端口是否已被使用
-        for device in self.devices.values():
-            if device.port == port:
-                messagebox.showerror("错误", f"端口 {port} 已被设备 {device.device_id} 使用")
-                return
+        if port in self._ports_in_use:
+            messagebox.showerror("错误", f"端口 {port} 已被设备 {self._ports_in_use[port]} 使用")
+            return
         
         # 创建新设备
         device_id = self.next_device_id
@@ -595,10 +800,10 @@ class MultiScannerApp:
         
         device = ScannerDevice(device_id, port)
         self.devices[device_id] = device
+        self._ports_in_use[port] = device_id
         
         # 更新设备列表
-        self.update_device_list()
-        self.update_status()
+        self._request_ui_refresh()
         
         # 立即保存设备配置
         self.save_devices()
@@ -612,8 +817,7 @@ class MultiScannerApp:
             messagebox.showwarning("警告", "请选择要移除的设备")
             return
         
-        item = selected[0]
-        device_id = int(self.device_tree.item(item)['values'][0])
+        device_id = int(selected[0])
         device = self.devices[device_id]
         
         # 先断开连接
@@ -622,10 +826,10 @@ class MultiScannerApp:
         
         # 移除设备
         del self.devices[device_id]
+        self._ports_in_use.pop(device.port, None)
         
         # 更新界面
-        self.update_device_list()
-        self.update_status()
+        self._request_ui_refresh()
         
         # 立即保存设备配置
         self.save_devices()
@@ -639,8 +843,7 @@ class MultiScannerApp:
             messagebox.showwarning("警告", "请选择要连接的设备")
             return
         
-        item = selected[0]
-        device_id = int(self.device_tree.item(item)['values'][0])
+        device_id = int(selected[0])
         device = self.devices[device_id]
         
         self.connect_device(device)
@@ -652,8 +855,7 @@ class MultiScannerApp:
             messagebox.showwarning("警告", "请选择要断开的设备")
             return
         
-        item = selected[0]
-        device_id = int(self.device_tree.item(item)['values'][0])
+        device_id = int(selected[0])
         device = self.devices[device_id]
         
         self.disconnect_device(device)
@@ -687,8 +889,10 @@ class MultiScannerApp:
             # 方法1: 使用Windows命令行工具清理串口资源
             try:
                 # 使用mode命令重置串口状态
+                # 打包后的窗口程序调用控制台命令时不弹出控制台窗口
                 subprocess.run(['mode', port, 'baud=9600', 'parity=n', 'data=8', 'stop=1'], 
-                             capture_output=True, timeout=5)
+                             capture_output=True, timeout=5,
+                             creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
                 time.sleep(0.5)
             except:
                 pass
@@ -823,7 +1027,7 @@ class MultiScannerApp:
             
             self.add_log(f"✅ {device.device_name} 连接成功")
             self.start_device_scanning(device)
-            self.update_device_list()
+            self._request_ui_refresh()
             
         except Exception as e:
             self.add_log(f"❌ {device.device_name} 标准连接失败: {e}")
@@ -835,16 +1039,11 @@ class MultiScannerApp:
                 # 尝试替代连接方法
                 if self.try_alternative_connection_methods(device):
                     self.start_device_scanning(device)
-                    self.update_device_list()
+                    self._request_ui_refresh()
                     return
             
             # 标准重试逻辑
-            connection_errors = ['device attached to the system is not functioning', 
-                               'permission', 'access', 'device not found', 
-                               'could not open port', 'serial exception']
-            
-            error_str = str(e).lower()
-            is_connection_error = any(err.lower() in error_str for err in connection_errors)
+            is_connection_error = bool(_CONN_ERR_RE.search(str(e)))
             
             if is_connection_error:
                 self.add_log(f"🔌 {device.device_name} 检测到连接问题，尝试重试...")
@@ -866,7 +1065,7 @@ class MultiScannerApp:
                 
                 self.add_log(f"✅ {device.device_name} 重试连接成功")
                 self.start_device_scanning(device)
-                self.update_device_list()
+                self._request_ui_refresh()
                 
             except Exception as retry_e:
                 self.add_log(f"❌ {device.device_name} 重试连接也失败: {retry_e}")
@@ -875,16 +1074,15 @@ class MultiScannerApp:
                 if "PermissionError" in str(retry_e) or "13" in str(retry_e):
                     if self.try_alternative_connection_methods(device):
                         self.start_device_scanning(device)
-                        self.update_device_list()
+                        self._request_ui_refresh()
                         return
                 
                 # 启动自动重连
-                error_str = str(retry_e).lower()
-                is_connection_error = any(err.lower() in error_str for err in connection_errors)
+                is_connection_error = bool(_CONN_ERR_RE.search(str(retry_e)))
                 
                 if is_connection_error:
                     self.add_log(f"🔌 {device.device_name} 启动智能重连...")
-                    threading.Thread(target=self.smart_reconnect_device, args=(device,), daemon=True).start()
+                    self.smart_reconnect_device(device)
                 else:
                     messagebox.showerror("连接失败", f"{device.device_name} 连接失败:\n原始错误: {e}\n重试错误: {retry_e}\n\n建议:\n1. 尝试更换USB端口\n2. 检查设备驱动程序\n3. 重启程序")
     
@@ -901,7 +1099,7 @@ class MultiScannerApp:
             self.force_disconnect_device(device)
             
             self.add_log(f"🔌 {device.device_name} 已断开")
-            self.update_device_list()
+            self._request_ui_refresh()
             
         except Exception as e:
             self.add_log(f"❌ 断开 {device.device_name} 失败: {e}")
@@ -912,7 +1110,7 @@ class MultiScannerApp:
         """强制断开设备连接，确保资源完全释放"""
         try:
             # 停止扫描线程
-            device.is_scanning = False
+            self.wake_scan_thread(device)
             
             # 等待扫描线程结束
             if hasattr(device, 'scan_thread') and device.scan_thread and device.scan_thread.is_alive():
@@ -925,39 +1123,19 @@ class MultiScannerApp:
             if device.serial_connection:
                 try:
                     if device.serial_connection.is_open:
-                        # 取消所有待处理的读写操作
+                        # 读取已由 wake_scan_thread 取消、扫描线程已退出（程序不向扫码枪写数据），
+                        # 只需丢弃驱动中未读的数据后关闭；不调用 flush()，避免等待输出缓冲排空
                         try:
-                            device.serial_connection.cancel_read()
-                        except (AttributeError, OSError):
-                            pass
-                        try:
-                            device.serial_connection.cancel_write()
-                        except (AttributeError, OSError):
-                            pass
-                        
-                        # 刷新缓冲区
-                        try:
-                            device.serial_connection.flush()
-                            device.serial_connection.flushInput()
-                            device.serial_connection.flushOutput()
-                        except AttributeError:
-                            try:
-                                device.serial_connection.flush()
-                                device.serial_connection.reset_input_buffer()
-                                device.serial_connection.reset_output_buffer()
-                            except (AttributeError, OSError):
-                                pass
-                        except OSError:
+                            device.serial_connection.reset_input_buffer()
+                        except (OSError, serial.SerialException):
                             pass
                         
                         # 关闭连接
                         device.serial_connection.close()
                         
-                    # 对于问题设备，增加更长的等待时间
+                    # 对于问题设备，关闭后等待驱动释放端口（其他端口 close() 返回时句柄已释放）
                     if device.port in ['COM4', 'COM6']:  # 根据实际情况调整
                         time.sleep(1.0)  # 增加等待时间
-                    else:
-                        time.sleep(0.2)
                     
                 except Exception as close_error:
                     self.add_log(f"⚠️ {device.device_name} 关闭串口时出错: {close_error}")
@@ -990,56 +1168,40 @@ class MultiScannerApp:
         if device.is_scanning:
             return
         
+        ser = device.serial_connection
+        try:
+            # 无数据时 read 在驱动中等待，首字节到达即返回，无需轮询
+            ser.timeout = SERIAL_READ_TIMEOUT
+            if hasattr(ser, 'set_buffer_size'):
+                ser.set_buffer_size(rx_size=SERIAL_RX_BUFFER_SIZE)
+        except Exception as e:
+            self.add_log(f"⚠️ {device.device_name} 串口参数设置失败: {e}")
+        
+        # pyserial 的 ReaderThread 负责读取循环（read(in_waiting or 1)），收到的数据交给 BarcodeProtocol
         device.is_scanning = True
-        device.scan_thread = threading.Thread(target=self.scan_worker, args=(device,), daemon=True)
+        device.scan_thread = serial.threaded.ReaderThread(ser, lambda: BarcodeProtocol(self, device))
         device.scan_thread.start()
         
         self.add_log(f"🔍 {device.device_name} 开始扫描")
-        self.update_device_list()
+        self._request_ui_refresh()
     
     def stop_device_scanning(self, device):
         """停止单个设备扫描"""
-        device.is_scanning = False
+        self.wake_scan_thread(device)
         self.add_log(f"⏹️ {device.device_name} 停止扫描")
-        self.update_device_list()
+        self._request_ui_refresh()
     
-    def scan_worker(self, device):
-        """扫描工作线程"""
-        buffer = ""
-        
-        while device.is_scanning and device.serial_connection and device.serial_connection.is_open:
+    def wake_scan_thread(self, device):
+        """通知扫描线程退出，并取消其正在阻塞的串口读取"""
+        device.is_scanning = False
+        if isinstance(device.scan_thread, serial.threaded.ReaderThread):
+            device.scan_thread.alive = False
+        ser = device.serial_connection
+        if ser is not None:
             try:
-                if device.serial_connection.in_waiting > 0:
-                    data = device.serial_connection.read(device.serial_connection.in_waiting)
-                    
-                    try:
-                        decoded_data = data.decode('utf-8')
-                    except UnicodeDecodeError:
-                        try:
-                            decoded_data = data.decode('gbk')
-                        except UnicodeDecodeError:
-                            decoded_data = data.decode('ascii', errors='ignore')
-                    
-                    buffer += decoded_data
-                    
-                    # 处理完整的扫描数据
-                    while '\n' in buffer or '\r' in buffer:
-                        if '\r\n' in buffer:
-                            line, buffer = buffer.split('\r\n', 1)
-                        elif '\n' in buffer:
-                            line, buffer = buffer.split('\n', 1)
-                        elif '\r' in buffer:
-                            line, buffer = buffer.split('\r', 1)
-                        
-                        line = line.strip()
-                        if line:
-                            self.process_scanned_data(device, line)
-                
-                time.sleep(0.01)
-                
-            except Exception as e:
-                self.root.after(0, lambda: self.handle_scan_error(device, str(e)))
-                break
+                ser.cancel_read()
+            except (AttributeError, OSError, serial.SerialException):
+                pass
     
     def process_scanned_data(self, device, data):
         """处理扫描到的数据"""
@@ -1050,24 +1212,22 @@ class MultiScannerApp:
             self.play_duplicate_sound()
             return
         
-        # 检查当天是否已经扫描过相同条码
-        if data in self.today_scanned_data:
+        # 检查当天是否已经扫描过相同条码（跨过零点时先切换到新一天的缓存），未扫描过的加入缓存并保存
+        if time.time() >= self._today_rollover_ts:
+            self._rotate_today_cache()
+        if not self.append_today_scan(data):
             self.root.after(0, lambda: self.add_log(f"📋 {device.device_name} 当天已扫描过，跳过上传: {data}"))
             # 播放重复扫描警告音
             self.play_duplicate_sound()
             # 仍然更新计数和显示，但不上传到数据库
             device.scan_count += 1
-            device.last_scan_time = datetime.now().strftime('%H:%M:%S')
+            device.last_scan_time = scan_time_strs()[1]
             self.total_scan_count += 1
             self.root.after(0, lambda: self.update_scan_display(device, data))
             return
         
-        # 添加到当天扫描数据缓存并保存
-        self.today_scanned_data.add(data)
-        self.save_today_scanned_data()
-        
         device.scan_count += 1
-        device.last_scan_time = datetime.now().strftime('%H:%M:%S')
+        device.last_scan_time = scan_time_strs()[1]
         self.total_scan_count += 1
         
         # 播放成功扫描提示音
@@ -1082,34 +1242,123 @@ class MultiScannerApp:
     
     def update_scan_display(self, device, data):
         """更新扫描显示"""
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        timestamp = scan_time_strs()[0]
         log_entry = f"[{timestamp}] {device.device_name} 第{device.scan_count}次: {data}"
         
         self.add_log(log_entry)
-        self.update_device_list()
-        self.update_status()
+        self._request_ui_refresh(device)
+    
+    def _request_ui_refresh(self, device=None):
+        """
+        请求刷新设备列表和状态栏（需在界面线程调用）
+        
+        指定 device 时只更新该设备的扫描计数；请求在 UI_REFRESH_INTERVAL_MS 内合并为一次刷新。
+        """
+        if device is None:
+            self._ui_full_dirty = True
+        else:
+            self._ui_dirty_devices[device.device_id] = device
+        if not self._ui_pending:
+            self._ui_pending = True
+            self.root.after(UI_REFRESH_INTERVAL_MS, self._flush_ui)
+    
+    def _flush_ui(self):
+        """执行合并后的界面刷新"""
+        self._ui_pending = False
+        dirty_devices = self._ui_dirty_devices
+        self._ui_dirty_devices = {}
+        if self._ui_full_dirty:
+            self._ui_full_dirty = False
+            self.update_device_list()
+            self.update_status()
+            return
+        for device in dirty_devices.values():
+            self._bump_device(device, update_counters=False)
+        self._update_scan_counters()
+    
+    def _bump_device(self, device, update_counters=True):
+        """扫描后的快速更新：只改该设备行的扫描次数、最后扫描两列和扫描计数"""
+        row = self._row_cache.get(device.device_id)
+        if row is None:
+            self.update_device_list()
+        else:
+            iid = str(device.device_id)
+            last_scan = device.last_scan_time or "--"
+            if row[3] != device.scan_count:
+                self.device_tree.set(iid, 'scan_count', device.scan_count)
+                row[3] = device.scan_count
+            if row[4] != last_scan:
+                self.device_tree.set(iid, 'last_scan', last_scan)
+                row[4] = last_scan
+        if update_counters:
+            self._update_scan_counters()
     
     def upload_to_database(self, device, data):
-        """异步上传数据到数据库"""
-        def upload_worker():
+        """将扫描数据放入上传队列，由后台上传线程处理"""
+        try:
+            self._upload_q.put_nowait((device, data))
+        except queue.Full:
+            try:
+                _, dropped = self._upload_q.get_nowait()
+                self.root.after(0, lambda: self.add_log(f"⚠️ 上传队列已满，丢弃最早的待上传数据: {dropped}"))
+            except queue.Empty:
+                pass
+            try:
+                self._upload_q.put_nowait((device, data))
+            except queue.Full:
+                pass
+    
+    def _upload_loop(self):
+        """上传线程：依次上传队列中的扫描数据，收到 (None, None) 时退出"""
+        while True:
+            device, data = self._upload_q.get()
+            if device is None:
+                break
             try:
-                # 修正方法名：从 upload_barcode_scan 改为 upload_scan_data
                 success = db.upload_scan_data(
                     barcode_data=data,
                     device_port=device.port
                 )
                 if success:
-                    self.root.after(0, lambda: self.add_log(f"✅ {device.device_name} 数据上传成功: {data}"))
+                    self.root.after(0, lambda device=device, data=data: self.add_log(f"✅ {device.device_name} 数据上传成功: {data}"))
                 else:
-                    self.root.after(0, lambda: self.add_log(f"⚠️ {device.device_name} 数据上传失败: {data}"))
+                    self.root.after(0, lambda device=device, data=data: self.add_log(f"⚠️ {device.device_name} 数据上传失败: {data}"))
             except Exception as e:
-                # 修复：将异常信息传递给 lambda 函数作为参数
                 error_msg = str(e)
-                self.root.after(0, lambda msg=error_msg: self.add_log(f"⚠️ {device.device_name} 数据库上传错误: {msg}"))
-
-        threading.Thread(target=upload_worker, daemon=True).start()
+                self.root.after(0, lambda device=device, msg=error_msg: self.add_log(f"⚠️ {device.device_name} 数据库上传错误: {msg}"))
     
-
+    def stop_upload_thread(self, timeout=5.0):
+        """让上传线程处理完已排队的数据后退出"""
+        if self._upload_thread is None or not self._upload_thread.is_alive():
+            return
+        try:
+            self._upload_q.put((None, None), timeout=timeout)
+        except queue.Full:
+            return
+        self._upload_thread.join(timeout=timeout)
+    
+    def _sync_local_data_before_exit(self, timeout=SHUTDOWN_SYNC_TIMEOUT):
+        """关闭前同步本地数据；网络卡住时不无限期阻塞窗口关闭"""
+        result = {}
+        
+        def worker():
+            try:
+                result['count'] = db.sync_local_data()
+            except Exception as e:
+                result['error'] = e
+        
+        sync_thread = threading.Thread(target=worker, daemon=True)
+        sync_thread.start()
+        sync_thread.join(timeout=timeout)
+        
+        if sync_thread.is_alive():
+            self.add_log(f"⚠️ 数据同步超过 {timeout:.0f} 秒未完成，未同步的数据将在下次启动时同步")
+        elif 'error' in result:
+            self.add_log(f"⚠️ 数据同步失败: {result['error']}")
+        elif result.get('count', 0) > 0:
+            self.add_log(f"📤 已同步 {result['count']} 条本地数据到数据库")
+        else:
+            self.add_log("📤 没有需要同步的本地数据")
     
     def handle_scan_error(self, device, error_msg):
         """处理扫描错误"""
@@ -1119,11 +1368,7 @@ class MultiScannerApp:
         device.is_scanning = False
         
         # 检查是否是连接相关的错误
-        connection_errors = ['device attached to the system is not functioning', 
-                           'permission', 'access', 'device not found', 
-                           'could not open port', 'serial exception']
-        
-        is_connection_error = any(err.lower() in error_msg.lower() for err in connection_errors)
+        is_connection_error = bool(_CONN_ERR_RE.search(error_msg))
         
         if is_connection_error:
             # 标记设备为断开状态
@@ -1131,143 +1376,133 @@ class MultiScannerApp:
             self.add_log(f"🔌 {device.device_name} 检测到连接问题，尝试自动重连...")
             
             # 启动自动重连
-            threading.Thread(target=self.auto_reconnect_device, args=(device,), daemon=True).start()
+            self.auto_reconnect_device(device)
         
-        self.update_device_list()
+        self._request_ui_refresh()
     
     def smart_reconnect_device(self, device):
-        """智能重连设备 - 使用多种策略"""
-        current_time = time.time()
-        
-        # 防止频繁重连
-        if device.last_error_time and (current_time - device.last_error_time) < 10:
-            return
-        
-        device.last_error_time = current_time
-        device.reconnect_attempts += 1
-        
-        if device.reconnect_attempts > device.max_reconnect_attempts:
-            self.root.after(0, lambda: self.add_log(f"❌ {device.device_name} 智能重连次数超限，请手动处理"))
-            return
-        
-        self.root.after(0, lambda: self.add_log(f"🧠 {device.device_name} 第{device.reconnect_attempts}次智能重连..."))
-        
-        # 使用递增等待时间
-        wait_time = min(10 * device.reconnect_attempts, 60)  # 最多等待60秒
-        time.sleep(wait_time)
-        
-        try:
-            # 强制断开
-            self.force_disconnect_device(device)
-            
-            # 系统级资源清理
-            self.cleanup_system_serial_resources(device.port)
-            time.sleep(2)
-            
-            # 尝试替代连接方法
-            if self.try_alternative_connection_methods(device):
-                device.reconnect_attempts = 0
-                self.root.after(0, lambda: self.add_log(f"✅ {device.device_name} 智能重连成功"))
-                self.root.after(0, lambda: self.start_device_scanning(device))
-                self.root.after(0, lambda: self.update_device_list())
-                return
-            
-            # 如果替代方法也失败，尝试标准方法
-            params = device.get_serial_params()
-            device.serial_connection = serial.Serial(port=device.port, **params)
-            device.is_connected = True
-            device.reconnect_attempts = 0
-            
-            self.root.after(0, lambda: self.add_log(f"✅ {device.device_name} 智能重连成功"))
-            self.root.after(0, lambda: self.start_device_scanning(device))
-            self.root.after(0, lambda: self.update_device_list())
-            
-        except Exception as e:
-            error_msg = str(e)
-            self.root.after(0, lambda msg=error_msg: self.add_log(f"❌ {device.device_name} 智能重连失败: {msg}"))
-            
-            # 如果还有重连机会，继续尝试
-            if device.reconnect_attempts < device.max_reconnect_attempts:
-                threading.Thread(target=self.smart_reconnect_device, args=(device,), daemon=True).start()
-
+        """智能重连设备 - 使用多种策略（在界面线程调用）"""
+        self._start_reconnect(device, smart=True)
+    
     def auto_reconnect_device(self, device):
-        """自动重连设备"""
+        """自动重连设备（在界面线程调用）"""
+        self._start_reconnect(device, smart=False)
+    
+    def _start_reconnect(self, device, smart):
+        """开始一轮自动重连（短时间内重复触发的错误只启动一次）"""
         current_time = time.time()
         
         # 防止频繁重连
-        if device.last_error_time and (current_time - device.last_error_time) < 5:
+        min_interval = 10 if smart else 5
+        if device.last_error_time and (current_time - device.last_error_time) < min_interval:
             return
         
         device.last_error_time = current_time
+        self._schedule_reconnect_attempt(device, smart)
+    
+    def _schedule_reconnect_attempt(self, device, smart):
+        """按递增的等待时间安排下一次重连尝试，等待期间不占用线程"""
         device.reconnect_attempts += 1
         
         if device.reconnect_attempts > device.max_reconnect_attempts:
-            self.root.after(0, lambda: self.add_log(f"❌ {device.device_name} 重连次数超限，请手动重连"))
+            if smart:
+                self.add_log(f"❌ {device.device_name} 智能重连次数超限，请手动处理")
+            else:
+                self.add_log(f"❌ {device.device_name} 重连次数超限，请手动重连")
             return
         
-        self.root.after(0, lambda: self.add_log(f"🔄 {device.device_name} 第{device.reconnect_attempts}次重连尝试..."))
-        
-        # 对于问题设备，使用更长的等待时间
-        if device.port in ['COM4', 'COM6']:
-            wait_time = 5 * device.reconnect_attempts  # 更长的递增等待时间
+        # 使用递增等待时间
+        if smart:
+            self.add_log(f"🧠 {device.device_name} 第{device.reconnect_attempts}次智能重连...")
+            wait_time = min(10 * device.reconnect_attempts, 60)  # 最多等待60秒
         else:
-            wait_time = 2 * device.reconnect_attempts
-        
-        time.sleep(wait_time)
+            self.add_log(f"🔄 {device.device_name} 第{device.reconnect_attempts}次重连尝试...")
+            # 对于问题设备，使用更长的等待时间
+            if device.port in ['COM4', 'COM6']:
+                wait_time = 5 * device.reconnect_attempts  # 更长的递增等待时间
+            else:
+                wait_time = 2 * device.reconnect_attempts
         
+        self.root.after(int(wait_time * 1000),
+                        lambda: self._reconnect_pool.submit(self._try_reconnect, device, smart))
+    
+    def _try_reconnect(self, device, smart):
+        """在重连线程池中执行一次重连尝试，结果回到界面线程处理"""
+        label = "智能重连" if smart else "自动重连"
         try:
             # 强制断开
             self.force_disconnect_device(device)
             
-            # 对于问题设备，增加更长的等待时间
-            if device.port in ['COM4', 'COM6']:
-                time.sleep(2.0)
+            if smart:
+                # 系统级资源清理后尝试替代连接方法
+                self.cleanup_system_serial_resources(device.port)
+                time.sleep(2)
+                connected = self.try_alternative_connection_methods(device)
             else:
-                time.sleep(1.0)
+                # 对于问题设备，增加更长的等待时间
+                time.sleep(2.0 if device.port in ['COM4', 'COM6'] else 1.0)
+                connected = False
             
-            # 尝试重连
-            params = device.get_serial_params()
-            device.serial_connection = serial.Serial(port=device.port, **params)
-            device.is_connected = True
+            if not connected:
+                # 标准方法
+                params = device.get_serial_params()
+                device.serial_connection = serial.Serial(port=device.port, **params)
+                device.is_connected = True
             device.reconnect_attempts = 0
             
-            self.root.after(0, lambda: self.add_log(f"✅ {device.device_name} 自动重连成功"))
+            self.root.after(0, lambda: self.add_log(f"✅ {device.device_name} {label}成功"))
             self.root.after(0, lambda: self.start_device_scanning(device))
-            self.root.after(0, lambda: self.update_device_list())
+            self.root.after(0, self._request_ui_refresh)
             
         except Exception as e:
             error_msg = str(e)
-            self.root.after(0, lambda msg=error_msg: self.add_log(f"❌ {device.device_name} 自动重连失败: {msg}"))
-            
-            # 如果还有重连机会，继续尝试
-            if device.reconnect_attempts < device.max_reconnect_attempts:
-                threading.Thread(target=self.auto_reconnect_device, args=(device,), daemon=True).start()
+            self.root.after(0, lambda: self._on_reconnect_failed(device, smart, error_msg))
+    
+    def _on_reconnect_failed(self, device, smart, error_msg):
+        """重连失败：记录日志，还有重连机会时安排下一次尝试"""
+        self.add_log(f"❌ {device.device_name} {'智能重连' if smart else '自动重连'}失败: {error_msg}")
+        
+        # 如果还有重连机会，继续尝试
+        if device.reconnect_attempts < device.max_reconnect_attempts:
+            self._schedule_reconnect_attempt(device, smart)
     
     def update_device_list(self):
-        """更新设备列表显示"""
-        # 清空现有项目
-        for item in self.device_tree.get_children():
-            self.device_tree.delete(item)
+        """更新设备列表显示（只改动发生变化的单元格）"""
+        tree = self.device_tree
+        columns = tree['columns']
         
-        # 添加设备信息
+        # 删除已移除设备的行
+        for device_id in [d for d in self._row_cache if d not in self.devices]:
+            tree.delete(str(device_id))
+            del self._row_cache[device_id]
+        
+        # 新增设备插入新行，已有设备逐列比较后只更新变化的单元格
         for device in self.devices.values():
             status = "扫描中" if device.is_scanning else ("已连接" if device.is_connected else "未连接")
             last_scan = device.last_scan_time or "--"
+            new = [device.device_id, device.port, status, device.scan_count, last_scan]
+            
+            iid = str(device.device_id)
+            old = self._row_cache.get(device.device_id)
+            if old is None:
+                tree.insert('', 'end', iid=iid, values=new)
+                self._row_cache[device.device_id] = new
+                continue
             
-            self.device_tree.insert('', 'end', values=(
-                device.device_id,
-                device.port,
-                status,
-                device.scan_count,
-                last_scan
-            ))
+            for i, value in enumerate(new):
+                if old[i] != value:
+                    tree.set(iid, columns[i], value)
+            self._row_cache[device.device_id] = new
+    
+    def _tick_clock(self):
+        """更新状态栏时钟（精确到分钟），并定时到下一个整分钟再次更新"""
+        now = datetime.now()
+        self.time_var.set(f"🕐 {now.strftime('%H:%M')}")
+        ms_to_next_minute = (60 - now.second) * 1000 - now.microsecond // 1000
+        self.root.after(max(ms_to_next_minute, 1) + 50, self._tick_clock)
     
     def update_status(self):
         """更新状态信息"""
-        # 更新时间
-        current_time = datetime.now().strftime("%H:%M:%S")
-        self.time_var.set(f"🕐 {current_time}")
-        
         connected_count = sum(1 for d in self.devices.values() if d.is_connected)
         scanning_count = sum(1 for d in self.devices.values() if d.is_scanning)
         
@@ -1279,12 +1514,7 @@ class MultiScannerApp:
         else:
             self.device_count_var.set(f"📱 设备: {connected_count}/{len(self.devices)} (已连接)")
         
-        # 更新总扫描次数
-        self.total_count_var.set(f"📊 总扫描: {self.total_scan_count}")
-        
-        # 更新统计信息
-        today_count = len(self.today_scanned_data)
-        self.scan_stats_var.set(f"📈 今日扫描: {today_count} | 📋 总计: {self.total_scan_count} | 🔄 重复: 0")
+        self._update_scan_counters()
         
         # 更新系统状态
         if scanning_count > 0:
@@ -1296,10 +1526,38 @@ class MultiScannerApp:
         else:
             self.status_var.set("📱 请添加设备")
     
+    def _update_scan_counters(self):
+        """更新总扫描次数与今日统计"""
+        # 更新总扫描次数
+        self.total_count_var.set(f"📊 总扫描: {self.total_scan_count}")
+        
+        # 更新统计信息
+        today_count = len(self.today_scanned_data)
+        self.scan_stats_var.set(f"📈 今日扫描: {today_count} | 📋 总计: {self.total_scan_count} | 🔄 重复: 0")
+    
     def add_log(self, message):
-        """添加日志"""
-        self.data_text.insert(tk.END, message + "\n")
-        self.data_text.see(tk.END)
+        """添加日志（先入队，由 _flush_log 批量显示）"""
+        self._log_q.append(message)
+    
+    def _flush_log(self):
+        """将积压的日志一次性写入文本框，并裁剪超出上限的旧日志"""
+        try:
+            if self._log_q:
+                batch = []
+                while self._log_q:
+                    batch.append(self._log_q.popleft())
+                # 用户向上翻看历史日志时不自动滚动到底部
+                follow = self.data_text.yview()[1] > 0.95
+                self.data_text.insert(tk.END, "\n".join(batch) + "\n")
+                
+                line_count = int(self.data_text.index('end-1c').split('.')[0])
+                if line_count > LOG_MAX_LINES:
+                    self.data_text.delete('1.0', f'{line_count - LOG_MAX_LINES + 1}.0')
+                if follow:
+                    self.data_text.see(tk.END)
+        except tk.TclError:
+            return  # 窗口已销毁
+        self.root.after(LOG_FLUSH_INTERVAL_MS, self._flush_log)
     
     def clear_data(self):
         """清空数据"""
@@ -1312,6 +1570,7 @@ class MultiScannerApp:
         if result is None:  # 取消
             return
         
+        self._log_q.clear()
         self.data_text.delete(1.0, tk.END)
         self.total_scan_count = 0
         
@@ -1321,18 +1580,21 @@ class MultiScannerApp:
             device.last_scan_time = None
         
         if result:  # 选择'是'，清空缓存
-            self.today_scanned_data.clear()
             try:
-                if os.path.exists(self.today_cache_file):
-                    os.remove(self.today_cache_file)
+                with self._today_lock:
+                    self.today_scanned_data.clear()
+                    if self._today_fd is not None:
+                        os.ftruncate(self._today_fd, 0)
+                        self._today_log_lines = 0
+                    elif os.path.exists(self.today_cache_file):
+                        os.remove(self.today_cache_file)
                 self.add_log("📝 扫描数据和当天缓存已清空")
             except Exception as e:
                 self.add_log(f"清空缓存文件失败: {e}")
         else:  # 选择'否'，保留缓存
             self.add_log("📝 扫描数据已清空（保留当天缓存）")
         
-        self.update_device_list()
-        self.update_status()
+        self._request_ui_refresh()
     
     def sync_data(self):
         """同步数据到数据库"""
@@ -1340,13 +1602,8 @@ class MultiScannerApp:
             return
         
         try:
-            if hasattr(db, 'DatabaseManagerHTTP'):
-                # 使用HTTP版本的数据库管理器
-                db_manager = db.DatabaseManagerHTTP()
-                synced_count = db_manager.sync_local_data()
-            else:
-                # 兼容旧版本
-                synced_count = db.sync_local_data()
+            # 使用模块的全局管理器同步（新建管理器会额外启动一套后台线程和连接）
+            synced_count = db.sync_local_data()
                 
             if synced_count > 0:
                 self.add_log(f"📤 已同步 {synced_count} 条本地数据到数据库")
@@ -1368,20 +1625,22 @@ class MultiScannerApp:
                 sound_enabled = config.get('sound_enabled', True)
                 self.sound_enabled.set(sound_enabled)
                 
-                available_ports = [p.device for p in serial.tools.list_ports.comports()]
+                available_ports = {p.device for p in self._list_ports()}
                 
                 for port in saved_ports:
+                    if port in self._ports_in_use:
+                        continue  # 配置文件中重复的端口
                     if port in available_ports:
                         device_id = self.next_device_id
                         self.next_device_id += 1
                         device = ScannerDevice(device_id, port)
                         self.devices[device_id] = device
+                        self._ports_in_use[port] = device_id
                         self.add_log(f"🔄 加载保存设备: {device.device_name}")
                     else:
                         self.add_log(f"⚠️ 保存端口 {port} 不可用，跳过")
                 
-                self.update_device_list()
-                self.update_status()
+                self._request_ui_refresh()
             except Exception as e:
                 self.add_log(f"⚠️ 加载配置失败: {e}")
 
@@ -1400,64 +1659,154 @@ class MultiScannerApp:
         except Exception as e:
             self.add_log(f"保存设备配置失败: {e}")
     
+    @staticmethod
+    def _next_midnight_ts():
+        """下一个本地零点的时间戳"""
+        tomorrow = datetime.now().date() + timedelta(days=1)
+        return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+    
+    def _rotate_today_cache(self):
+        """跨天时关闭前一天的缓存文件，清空去重集合并切换到新一天的文件"""
+        with self._today_lock:
+            if time.time() < self._today_rollover_ts:
+                return  # 其他扫描线程已完成切换
+            self.close_today_log()
+            self.today_scanned_data = set()
+            self.today_cache_file = f"today_scans_{datetime.now().strftime('%Y%m%d')}.ndjson"
+            self.save_today_scanned_data()
+            self._today_rollover_ts = self._next_midnight_ts()
+        self.add_log(f"📅 已切换到新一天的扫描缓存: {self.today_cache_file}")
+        self.cleanup_expired_cache_files()
+    
     def load_today_scanned_data(self):
-        """加载当天已扫描的数据"""
+        """加载当天已扫描的数据，追加日志有重复行、残缺行或存在旧版缓存时压缩重写"""
+        self.today_scanned_data = set()
         try:
+            # 兼容旧版本的整表JSON缓存
+            legacy_file = self.today_cache_file[:-len('.ndjson')] + '.json'
+            needs_compaction = os.path.exists(legacy_file)
+            if needs_compaction:
+                with open(legacy_file, 'r', encoding='utf-8') as f:
+                    self.today_scanned_data.update(json.load(f))
+            
+            line_count = 0
             if os.path.exists(self.today_cache_file):
-                with open(self.today_cache_file, 'r', encoding='utf-8') as f:
-                    data_list = json.load(f)
-                    self.today_scanned_data = set(data_list)
-                    self.add_log(f"已加载当天扫描数据缓存: {len(self.today_scanned_data)} 条记录")
+                with open(self.today_cache_file, 'r', encoding='utf-8', newline='') as f:
+                    # 只按 \n 切分：条码中可能含有 GS 等会被 splitlines 当作换行的字符
+                    lines = f.read().split('\n')
+                # 最后一段不为空说明最后一行缺少换行符，重写文件补齐，避免下次追加时与其连成一行
+                tail = lines.pop()
+                if tail:
+                    lines.append(tail)
+                    needs_compaction = True
+                line_count = len(lines)
+                self.today_scanned_data.update(line for line in lines if line)
+            
+            if self.today_scanned_data:
+                self.add_log(f"已加载当天扫描数据缓存: {len(self.today_scanned_data)} 条记录")
             else:
-                self.today_scanned_data = set()
                 self.add_log("创建新的当天扫描数据缓存")
+            
+            if needs_compaction or line_count != len(self.today_scanned_data):
+                self.save_today_scanned_data()
+            else:
+                self._open_today_log()
+                self._today_log_lines = line_count
+            if os.path.exists(legacy_file):
+                os.remove(legacy_file)
         except Exception as e:
             self.add_log(f"加载当天扫描数据失败: {e}")
-            self.today_scanned_data = set()
     
-    def save_today_scanned_data(self):
-        """保存当天扫描数据到本地文件"""
+    def save_today_scanned_data(self, reopen=True):
+        """将当天扫描数据整体重写（压缩）到本地文件，并重新打开追加句柄（reopen=False 时不再打开）"""
         try:
-            with open(self.today_cache_file, 'w', encoding='utf-8') as f:
-                json.dump(list(self.today_scanned_data), f, ensure_ascii=False, indent=2)
+            self.close_today_log()
+            tmp_path = self.today_cache_file + '.tmp'
+            content = ''.join(f"{data}\n" for data in self.today_scanned_data).encode('utf-8')
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, self.today_cache_file)
+            self._today_log_lines = len(self.today_scanned_data)
+            if reopen:
+                self._open_today_log()
         except Exception as e:
             self.add_log(f"保存当天扫描数据失败: {e}")
     
-    def play_success_sound(self):
-        """播放成功扫描提示音"""
-        if not self.sound_enabled.get():
+    def _open_today_log(self):
+        """以追加方式打开当天缓存文件"""
+        self._today_fd = os.open(self.today_cache_file,
+                                 os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0),
+                                 0o644)
+    
+    def append_today_scan(self, data):
+        """
+        当天未扫描过该条码时加入去重集合并追加到当天缓存文件，返回是否为当天首次扫描
+        
+        查重、加入集合和写文件都在 _today_lock 内完成，不会与零点切换或清空缓存交错（写入已关闭的句柄）。
+        """
+        with self._today_lock:
+            if data in self.today_scanned_data:
+                return False
+            self.today_scanned_data.add(data)
+            if self._today_fd is None:
+                self.save_today_scanned_data()
+                return True
+            try:
+                os.write(self._today_fd, f"{data}\n".encode('utf-8'))
+                self._today_log_lines += 1
+            except Exception as e:
+                self.add_log(f"保存当天扫描数据失败: {e}")
+            return True
+    
+    def close_today_log(self):
+        """关闭当天缓存文件的追加句柄"""
+        if self._today_fd is not None:
+            try:
+                os.close(self._today_fd)
+            except OSError:
+                pass
+            self._today_fd = None
+    
+    def _on_sound_enabled_changed(self, *args):
+        """声音开关变化时同步到 _sound_on"""
+        self._sound_on = self.sound_enabled.get()
+    
+    def beep(self, kind):
+        """异步播放提示音，正在播放时丢弃本次请求（可在扫描线程中直接调用）"""
+        if not self._sound_on or self._beep_busy.is_set():
             return
+        self._beep_busy.set()
+        try:
+            self._beep_pool.submit(self._do_beep, kind)
+        except RuntimeError:
+            self._beep_busy.clear()  # 线程池已关闭（程序退出中）
+    
+    def _do_beep(self, kind):
+        """在提示音线程中播放系统声音"""
         try:
-            # 播放系统默认的成功提示音
-            winsound.MessageBeep(winsound.MB_OK)
+            winsound.MessageBeep(kind)
         except Exception as e:
             pass  # 忽略声音播放错误
+        finally:
+            self._beep_busy.clear()
+    
+    def play_success_sound(self):
+        """播放成功扫描提示音"""
+        self.beep(winsound.MB_OK)
     
     def play_duplicate_sound(self):
         """播放重复扫描警告音"""
-        if not self.sound_enabled.get():
-            return
-        try:
-            # 播放系统警告音
-            winsound.MessageBeep(winsound.MB_ICONEXCLAMATION)
-        except Exception as e:
-            pass  # 忽略声音播放错误
+        self.beep(winsound.MB_ICONEXCLAMATION)
     
     def play_error_sound(self):
         """播放错误提示音"""
-        if not self.sound_enabled.get():
-            return
-        try:
-            # 播放系统错误音
-            winsound.MessageBeep(winsound.MB_ICONHAND)
-        except Exception as e:
-            pass  # 忽略声音播放错误
+        self.beep(winsound.MB_ICONHAND)
     
     def cleanup_expired_cache_files(self):
         """清理过期的缓存文件"""
         try:
             current_date = datetime.now().strftime('%Y%m%d')
-            cache_pattern = 'today_scans_*.json'
+            cache_pattern = 'today_scans_*.*json'
             
             import glob
             cache_files = glob.glob(cache_pattern)
@@ -1487,41 +1836,33 @@ class MultiScannerApp:
         try:
             self.add_log("🔄 正在关闭程序，请稍候...")
             
-            # 保存当天扫描数据
-            self.save_today_scanned_data()
-            
             # 停止所有扫描
             self.stop_all_scanning()
             
             # 强制断开所有设备并等待资源释放
             self.force_disconnect_all_devices()
             
+            # 扫描已全部停止；追加日志的行数与去重集合不一致时压缩后关闭
+            if self._today_log_lines != len(self.today_scanned_data):
+                self.save_today_scanned_data(reopen=False)
+            else:
+                self.close_today_log()
+            
             # 保存设备配置
             self.save_devices()
+            
+            # 取消尚未开始的自动重连
+            self._reconnect_pool.shutdown(wait=False, cancel_futures=True)
+            
+            # 等待已排队的扫描交给数据库模块
+            self.stop_upload_thread()
 
-            # 同步数据 (同步执行，确保完成)
+            # 同步数据（在后台线程执行，最多等待 SHUTDOWN_SYNC_TIMEOUT 秒）
             if DATABASE_AVAILABLE:
-                try:
-                    if hasattr(db, 'DatabaseManagerHTTP'):
-                        # 使用HTTP版本的数据库管理器
-                        db_manager = db.DatabaseManagerHTTP()
-                        synced_count = db_manager.sync_local_data()
-                    else:
-                        # 兼容旧版本
-                        synced_count = db.sync_local_data()
-                    
-                    if synced_count > 0:
-                        self.add_log(f"📤 已同步 {synced_count} 条本地数据到数据库")
-                    else:
-                        self.add_log("📤 没有需要同步的本地数据")
-                except Exception as e:
-                    self.add_log(f"⚠️ 数据同步失败: {e}")
+                self._sync_local_data_before_exit()
             
             self.add_log("✅ 程序关闭完成")
             
-            # 等待一段时间确保所有资源释放
-            time.sleep(1.0)
-            
         except Exception as e:
             print(f"关闭程序时发生错误: {e}")
         finally:
@@ -1532,17 +1873,16 @@ class MultiScannerApp:
         """强制断开所有设备并等待资源释放"""
         self.add_log("🔌 正在断开所有设备连接...")
         
-        # 停止所有扫描线程
+        # 停止所有扫描线程（取消阻塞中的读取，线程会立即退出）
         for device in self.devices.values():
-            device.is_scanning = False
+            self.wake_scan_thread(device)
         
-        # 等待扫描线程结束
-        time.sleep(0.5)
-        
-        # 强制断开所有设备
-        for device in self.devices.values():
-            if device.is_connected or device.serial_connection:
-                self.force_disconnect_device(device)
+        # 强制断开所有设备（各端口是独立的句柄，并行关闭，总耗时约等于最慢的一个）
+        to_close = [device for device in self.devices.values()
+                    if device.is_connected or device.serial_connection]
+        if to_close:
+            with ThreadPoolExecutor(max_workers=len(to_close), thread_name_prefix='disconnect') as executor:
+                list(executor.map(self.force_disconnect_device, to_close))
         
         # 额外等待时间确保Windows系统释放串口资源
         time.sleep(1.0)
@@ -1671,29 +2011,19 @@ class MultiScannerApp:
         return tooltip
     
     def cleanup_orphaned_serial_connections(self):
-        """清理可能的孤立串口连接"""
+        """
+        检查可用串口（只枚举，不打开端口）
+        
+        被占用的端口在连接时 serial.Serial() 会直接报错，无需逐个打开探测；
+        打开端口会阻塞启动，部分驱动还会因此复位设备。
+        """
         try:
-            import psutil
-            import serial.tools.list_ports
-            
-            # 获取所有可用串口
-            available_ports = [port.device for port in serial.tools.list_ports.comports()]
-            
-            # 尝试短暂打开和关闭每个串口以清理可能的孤立连接
-            for port in available_ports:
-                try:
-                    test_serial = serial.Serial(port, timeout=0.1)
-                    test_serial.close()
-                    time.sleep(0.1)
-                except:
-                    pass  # 忽略错误，继续处理下一个端口
-                    
-        except ImportError:
-            # 如果没有psutil模块，跳过清理
-            pass
+            in_use = {device.port for device in getattr(self, 'devices', {}).values()}
+            idle_ports = [port.device for port in self._list_ports() if port.device not in in_use]
+            if idle_ports:
+                self.add_log(f"🔌 未被本程序使用的串口: {', '.join(idle_ports)}")
         except Exception as e:
-            if hasattr(self, 'add_log'):
-                self.add_log(f"⚠️ 串口资源清理时出错: {e}")
+            self.add_log(f"⚠️ 串口检查时出错: {e}")
 
 
 class ToolTip:
@@ -0,0 +1,95 @@
+"""
+诊断/维护脚本共用的 Supabase REST 会话
+所有请求复用同一个 requests.Session，连续请求不再重复进行 TCP/TLS 握手
+"""
+import json
+import os
+import socket
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+# 优先使用 orjson 加速批量读写时的 JSON 编解码，未安装时退回标准库
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# 加载环境变量
+load_dotenv()
+
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_KEY = os.getenv('SUPABASE_KEY')
+API_URL = f"{SUPABASE_URL}/rest/v1"
+
+# 请求超时 (连接, 读取) 秒；失败由会话自动重试，单次超时可以设得较短。批量读写使用较长的读取超时
+DEFAULT_TIMEOUT = (3.05, 10)
+BULK_TIMEOUT = (3.05, 30)
+
+
+def dumps(obj) -> bytes:
+    """把对象序列化为 JSON（UTF-8 字节），用作请求体"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+def loads(data):
+    """解析 JSON 文本或字节（如 response.content）"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def config_complete() -> bool:
+    """检查数据库配置是否完整，不完整时打印提示"""
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        print("❌ 数据库配置不完整")
+        return False
+    return True
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """连接池的套接字关闭 Nagle 算法并开启 TCP keepalive"""
+
+    # urllib3 的默认选项即 TCP_NODELAY（小请求立即发出）；再加上 SO_KEEPALIVE，空闲连接不会被中间设备悄悄断开
+    SOCKET_OPTIONS = HTTPConnection.default_socket_options + [
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    ]
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self.SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
+
+
+def _create_session() -> requests.Session:
+    """创建带连接池和自动重试的会话，认证请求头只设置一次"""
+    session = requests.Session()
+    if SUPABASE_KEY:
+        # 写入默认不返回插入/更新后的记录（脚本只检查状态码）；需要返回内容时按请求覆盖 Prefer
+        session.headers.update({
+            'apikey': SUPABASE_KEY,
+            'Authorization': f'Bearer {SUPABASE_KEY}',
+            'Content-Type': 'application/json',
+            'Prefer': 'return=minimal'
+        })
+
+    # 只对幂等请求按指数退避重试限流和服务端错误（遵循 Retry-After）；
+    # 测试插入用的 POST 不重试，避免写入重复的测试记录
+    retry = Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD', 'PATCH']),
+        respect_retry_after_header=True
+    )
+    adapter = _KeepAliveAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+SESSION = _create_session()
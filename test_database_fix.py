@@ -1,185 +1,113 @@
 """
 测试数据库连接和修复
 """
+import functools
+import logging
 import os
-import requests
-from dotenv import load_dotenv
 import time
-from datetime import datetime
+from datetime import datetime, timezone
+from supabase_session import SESSION, API_URL, DEFAULT_TIMEOUT, config_complete
 
-# 加载环境变量
-load_dotenv()
+# 步骤耗时通过日志输出（LOG_LEVEL 控制）；诊断结果和失败响应内容直接打印
+logger = logging.getLogger(__name__)
 
-def check_table_structure():
-    """检查数据库表结构"""
-    supabase_url = os.getenv('SUPABASE_URL')
-    supabase_key = os.getenv('SUPABASE_KEY')
-    
-    if not supabase_url or not supabase_key:
-        print("❌ 数据库配置不完整")
-        return False
-    
-    api_url = f"{supabase_url}/rest/v1"
-    headers = {
-        'apikey': supabase_key,
-        'Authorization': f'Bearer {supabase_key}',
-        'Content-Type': 'application/json'
-    }
+def timed(name):
+    """装饰诊断步骤：结束后（无论成功、失败还是抛出异常）记录该步骤的耗时"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                logger.info("⏱️ %s: %.0f ms", name, (time.perf_counter() - start) * 1000)
+        return wrapper
+    return decorator
+
+def _call(method, path, ok_msg, fail_msg, error_msg, ok_codes=(200, 201, 204), **kwargs):
+    """
+    发送一次诊断请求并打印结果
     
+    成功时打印 ok_msg 并返回响应；HTTP 状态异常或请求出错时打印对应信息并返回 None。
+    """
     try:
-        print("🔍 检查表结构...")
-        
-        # 尝试获取表的一条记录来了解字段结构
-        response = requests.get(
-            f"{api_url}/barcode_scans?limit=1",
-            headers=headers,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data:
-                print("📋 当前表字段:")
-                for key in data[0].keys():
-                    print(f"  - {key}")
-            else:
-                print("📋 表为空，无法获取字段信息")
-            return True
-        else:
-            print(f"❌ 无法获取表结构: HTTP {response.status_code}")
-            print(f"响应内容: {response.text}")
-            return False
-            
+        response = SESSION.request(method, f"{API_URL}{path}", timeout=DEFAULT_TIMEOUT, **kwargs)
     except Exception as e:
-        print(f"❌ 检查表结构失败: {e}")
+        print(f"❌ {error_msg}: {e}")
+        return None
+    
+    if response.status_code not in ok_codes:
+        print(f"❌ {fail_msg}: HTTP {response.status_code}")
+        print(f"响应内容: {response.text}")
+        return None
+    
+    if ok_msg:
+        print(ok_msg)
+    return response
+
+def _test_stamp():
+    """由一次 time.time_ns() 同时得到秒级时间戳（测试条码后缀）和对应的 UTC ISO 时间"""
+    sec = time.time_ns() // 1_000_000_000
+    return sec, datetime.fromtimestamp(sec, timezone.utc).isoformat()
+
+@timed('table_structure')
+def check_table_structure():
+    """检查数据库表结构"""
+    print("🔍 检查表结构...")
+    # 尝试获取表的一条记录来了解字段结构
+    response = _call('GET', '/barcode_scans?limit=1', None, "无法获取表结构", "检查表结构失败", ok_codes=(200,))
+    if response is None:
         return False
+    
+    data = response.json()
+    if data:
+        print("📋 当前表字段:")
+        for key in data[0].keys():
+            print(f"  - {key}")
+    else:
+        print("📋 表为空，无法获取字段信息")
+    return True
 
+@timed('status_insert')
 def test_status_insert():
     """测试状态插入功能"""
-    supabase_url = os.getenv('SUPABASE_URL')
-    supabase_key = os.getenv('SUPABASE_KEY')
-    
-    api_url = f"{supabase_url}/rest/v1"
-    headers = {
-        'apikey': supabase_key,
-        'Authorization': f'Bearer {supabase_key}',
-        'Content-Type': 'application/json'
+    print("🔄 测试状态插入...")
+    # 测试插入带状态的记录
+    sec, iso_time = _test_stamp()
+    test_data = {
+        'barcode_data': f'STATUS-TEST-{sec}',
+        'device_port': 'TEST',
+        'status_1_scheduled': True,
+        'status_1_time': iso_time
     }
-    
-    try:
-        print("🔄 测试状态插入...")
-        
-        current_time = datetime.now().isoformat()
-        
-        # 测试插入带状态的记录
-        test_data = {
-            'barcode_data': 'STATUS-TEST-' + str(int(time.time())),
-            'device_port': 'TEST',
-            'status_1_scheduled': True,
-            'status_1_time': current_time
-        }
-        
-        insert_response = requests.post(
-            f"{api_url}/barcode_scans",
-            headers=headers,
-            json=test_data,
-            timeout=10
-        )
-        
-        if insert_response.status_code in [200, 201]:
-            print("✅ 状态记录插入成功")
-            return True
-        else:
-            print(f"❌ 状态记录插入失败: HTTP {insert_response.status_code}")
-            print(f"响应内容: {insert_response.text}")
-            return False
-            
-    except Exception as e:
-        print(f"❌ 状态插入测试失败: {e}")
-        return False
+    return _call('POST', '/barcode_scans', "✅ 状态记录插入成功", "状态记录插入失败", "状态插入测试失败",
+                 ok_codes=(200, 201), json=test_data) is not None
 
+@timed('basic_insert')
 def test_basic_insert():
     """测试基本插入功能"""
-    supabase_url = os.getenv('SUPABASE_URL')
-    supabase_key = os.getenv('SUPABASE_KEY')
-    
-    api_url = f"{supabase_url}/rest/v1"
-    headers = {
-        'apikey': supabase_key,
-        'Authorization': f'Bearer {supabase_key}',
-        'Content-Type': 'application/json'
+    print("🔄 测试基本插入...")
+    # 只使用最基本的字段（不包含scan_time）
+    test_data = {
+        'barcode_data': f'BASIC-TEST-{time.time_ns() // 1_000_000_000}',
+        'device_port': 'TEST'
     }
-    
-    try:
-        print("🔄 测试基本插入...")
-        
-        # 只使用最基本的字段（不包含scan_time）
-        test_data = {
-            'barcode_data': 'BASIC-TEST-' + str(int(time.time())),
-            'device_port': 'TEST'
-        }
-        
-        insert_response = requests.post(
-            f"{api_url}/barcode_scans",
-            headers=headers,
-            json=test_data,
-            timeout=10
-        )
-        
-        if insert_response.status_code in [200, 201]:
-            print("✅ 基本记录插入成功")
-            return True
-        else:
-            print(f"❌ 记录插入失败: HTTP {insert_response.status_code}")
-            print(f"响应内容: {insert_response.text}")
-            return False
-            
-    except Exception as e:
-        print(f"❌ 插入测试失败: {e}")
-        return False
+    return _call('POST', '/barcode_scans', "✅ 基本记录插入成功", "记录插入失败", "插入测试失败",
+                 ok_codes=(200, 201), json=test_data) is not None
 
+@timed('connection')
 def test_database_connection():
     """测试数据库连接"""
-    supabase_url = os.getenv('SUPABASE_URL')
-    supabase_key = os.getenv('SUPABASE_KEY')
-    
-    if not supabase_url or not supabase_key:
-        print("❌ 数据库配置不完整")
-        return False
-    
-    api_url = f"{supabase_url}/rest/v1"
-    headers = {
-        'apikey': supabase_key,
-        'Authorization': f'Bearer {supabase_key}',
-        'Content-Type': 'application/json'
-    }
-    
-    try:
-        # 测试连接
-        print("🔄 测试数据库连接...")
-        response = requests.get(
-            f"{api_url}/barcode_scans?limit=1",
-            headers=headers,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            print("✅ 数据库连接成功")
-            return True
-        else:
-            print(f"❌ 数据库连接失败: HTTP {response.status_code}")
-            print(f"响应内容: {response.text}")
-            return False
-            
-    except Exception as e:
-        print(f"❌ 数据库测试失败: {e}")
-        return False
+    print("🔄 测试数据库连接...")
+    return _call('GET', '/barcode_scans?limit=1', "✅ 数据库连接成功", "数据库连接失败", "数据库测试失败",
+                 ok_codes=(200,)) is not None
 
 if __name__ == "__main__":
+    logging.basicConfig(level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO').upper(), logging.INFO), format='%(message)s')
     print("🧪 开始数据库诊断...")
     
     # 1. 测试连接
-    if test_database_connection():
+    if config_complete() and test_database_connection():
         # 2. 检查表结构
         if check_table_structure():
             # 3. 测试基本插入
@@ -187,4 +115,4 @@ if __name__ == "__main__":
                 # 4. 测试状态插入
                 test_status_insert()
     
-    print("\n📊 诊断完成")
\ No newline at end of file
+    print("\n📊 诊断完成")
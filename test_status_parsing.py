@@ -2,16 +2,23 @@
 测试状态解析功能
 """
 
+# 条码前缀 -> 状态
+PREFIX_TO_STATUS = {
+    '1@': '已切割',
+    '2@': '已清角',
+    '3@': '已入库'
+}
+
 def parse_barcode_status(barcode_data: str) -> tuple:
-    """解析条码数据中的状态信息"""
-    if barcode_data.startswith('1@'):
-        return barcode_data[2:], '已切割'
-    elif barcode_data.startswith('2@'):
-        return barcode_data[2:], '已清角'
-    elif barcode_data.startswith('3@'):
-        return barcode_data[2:], '已入库'
-    else:
-        return barcode_data, None
+    """解析条码数据中的状态信息（按前两个字符查表）"""
+    status = PREFIX_TO_STATUS.get(barcode_data[:2])
+    if status:
+        return barcode_data[2:], status
+    return barcode_data, None
+
+def parse_all(barcodes) -> list:
+    """一次解析全部条码，返回 (原始条码, 条码, 状态) 列表"""
+    return [(barcode, *parse_barcode_status(barcode)) for barcode in barcodes]
 
 def test_status_parsing():
     """测试状态解析功能"""
@@ -27,12 +34,11 @@ def test_status_parsing():
         "3@Rich-052125-16-17"
     ]
     
-    for barcode in test_cases:
-        clean_barcode, status = parse_barcode_status(barcode)
-        print(f"原始: {barcode}")
-        print(f"  -> 条码: {clean_barcode}")
-        print(f"  -> 状态: {status or '无状态'}")
-        print()
+    # 一次解析全部用例，结果拼成一段文本后一次输出
+    print("\n".join(
+        f"原始: {barcode}\n  -> 条码: {clean_barcode}\n  -> 状态: {status or '无状态'}\n"
+        for barcode, clean_barcode, status in parse_all(test_cases)
+    ))
 
 if __name__ == "__main__":
     test_status_parsing()
\ No newline at end of file
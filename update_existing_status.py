@@ -2,93 +2,163 @@
 更新现有数据的状态字段
 根据条码数据前缀自动设置状态
 """
-import os
-import requests
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from supabase_session import SESSION, API_URL, DEFAULT_TIMEOUT, BULK_TIMEOUT, config_complete, dumps, loads
 
-# 加载环境变量
-load_dotenv()
+# 条码前缀 -> 状态
+PREFIX_TO_STATUS = {
+    '1@': '已切割',
+    '2@': '已清角',
+    '3@': '已入库'
+}
+
+# 服务端过滤：只读取更新需要的两列，且只返回带已知状态前缀的条码（PostgREST 的 like 用 * 作通配符）
+NULL_RECORDS_FILTER = (
+    "status=is.null&select=id,barcode_data"
+    "&or=(" + ",".join(f"barcode_data.like.{prefix}*" for prefix in PREFIX_TO_STATUS) + ")"
+)
+
+# 每页读取的待更新记录数（PostgREST 默认也会限制单次返回的行数）
+FETCH_PAGE_SIZE = 1000
+
+# 每次批量 upsert 提交的记录数
+UPSERT_BATCH_SIZE = 500
+
+# 批量 upsert 不可用时逐条 PATCH 的并发数（不超过共享会话的连接池大小 16）
+PATCH_MAX_WORKERS = 16
 
 def parse_barcode_status(barcode_data: str) -> str:
-    """解析条码数据中的状态信息"""
-    if barcode_data.startswith('1@'):
-        return '已切割'
-    elif barcode_data.startswith('2@'):
-        return '已清角'
-    elif barcode_data.startswith('3@'):
-        return '已入库'
-    else:
+    """解析条码数据中的状态信息（按前两个字符查表）"""
+    return PREFIX_TO_STATUS.get(barcode_data[:2])
+
+def chunks(items, size):
+    """把可迭代对象按 size 条一组切分"""
+    it = iter(items)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+def iter_null_record_pages(page_size=FETCH_PAGE_SIZE):
+    """
+    按 id 分页读取状态为NULL且带状态前缀的记录，每次产出一页
+    
+    更新后的记录会离开 status=is.null 的结果集，用 offset 翻页会跳过记录，
+    因此按上一页最后的 id 继续读取（id=gt.N）。
+    """
+    last_id = None
+    while True:
+        id_filter = f"&id=gt.{last_id}" if last_id is not None else ""
+        response = SESSION.get(
+            f"{API_URL}/barcode_scans?{NULL_RECORDS_FILTER}{id_filter}&order=id.asc&limit={page_size}",
+            timeout=BULK_TIMEOUT
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"获取记录失败: HTTP {response.status_code}")
+        
+        records = loads(response.content)
+        if records:
+            yield records
+        if len(records) < page_size:
+            return
+        last_id = records[-1]['id']
+
+def _patch_status(row):
+    """单条 PATCH 更新状态，返回 (记录, 是否成功, HTTP状态码或异常信息)"""
+    try:
+        response = SESSION.patch(
+            f"{API_URL}/barcode_scans?id=eq.{row['id']}",
+            json={'status': row['status']},
+            timeout=DEFAULT_TIMEOUT
+        )
+    except Exception as e:
+        return row, False, e
+    return row, response.status_code in (200, 204), response.status_code
+
+def patch_statuses_concurrently(rows):
+    """批量 upsert 不可用时的回退：多线程并发逐条 PATCH，返回成功条数"""
+    updated_count = 0
+    with ThreadPoolExecutor(max_workers=PATCH_MAX_WORKERS) as executor:
+        for row, ok, detail in executor.map(_patch_status, rows):
+            if ok:
+                print(f"✅ 更新记录 {row['id']}: {row['barcode_data']} -> {row['status']}")
+                updated_count += 1
+            else:
+                print(f"❌ 更新记录 {row['id']} 失败: {detail}")
+    return updated_count
+
+def backfill_on_server():
+    """
+    调用数据库函数 backfill_barcode_status 在服务端一次完成回填
+    
+    返回更新的记录数；数据库未创建该函数或调用失败时返回 None，由调用方改为客户端分页更新。
+    """
+    try:
+        response = SESSION.post(f"{API_URL}/rpc/backfill_barcode_status", data=b'{}', timeout=BULK_TIMEOUT)
+    except Exception as e:
+        print(f"⚠️ 调用 backfill_barcode_status 失败，改为分页更新: {e}")
+        return None
+    
+    if response.status_code != 200:
+        print(f"⚠️ 调用 backfill_barcode_status 失败 (HTTP {response.status_code})，改为分页更新")
         return None
+    return int(loads(response.content) or 0)
 
 def update_existing_records():
     """更新现有记录的状态字段"""
     print("🔄 开始更新现有记录的状态字段...")
     
-    # 获取配置
-    supabase_url = os.getenv('SUPABASE_URL')
-    supabase_key = os.getenv('SUPABASE_KEY')
-    
-    if not supabase_url or not supabase_key:
-        print("❌ 数据库配置不完整")
+    if not config_complete():
         return False
     
-    # 构建API端点
-    api_url = f"{supabase_url}/rest/v1"
-    headers = {
-        'apikey': supabase_key,
-        'Authorization': f'Bearer {supabase_key}',
-        'Content-Type': 'application/json'
-    }
+    # 优先在数据库端用一条 UPDATE 完成（见 database_setup.sql 中的 backfill_barcode_status）
+    updated_count = backfill_on_server()
+    if updated_count is not None:
+        print(f"\n🎉 更新完成！数据库端更新了 {updated_count} 条记录")
+        return True
     
     try:
-        # 1. 获取所有状态为NULL的记录
+        # 1. 分页获取状态为NULL的记录，读一页处理一页，内存占用与总记录数无关
         print("📋 获取需要更新的记录...")
-        response = requests.get(
-            f"{api_url}/barcode_scans?status=is.null&order=id.asc",
-            headers=headers,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            print(f"❌ 获取记录失败: HTTP {response.status_code}")
-            return False
-        
-        records = response.json()
-        print(f"📊 找到 {len(records)} 条需要更新的记录")
-        
-        if not records:
-            print("✅ 没有需要更新的记录")
-            return True
-        
-        # 2. 逐条更新记录
+        found_count = 0
         updated_count = 0
-        for record in records:
-            record_id = record['id']
-            barcode_data = record['barcode_data']
+        for records in iter_null_record_pages():
+            found_count += len(records)
+            print(f"📊 读取到 {len(records)} 条需要更新的记录（累计 {found_count} 条）")
             
-            # 解析状态
-            status = parse_barcode_status(barcode_data)
+            # 2. 解析状态（barcode_data 为非空列，一并提交以满足 upsert 的插入校验）
+            payload = []
+            for record in records:
+                status = parse_barcode_status(record['barcode_data'])
+                if status:
+                    payload.append({'id': record['id'], 'barcode_data': record['barcode_data'], 'status': status})
+                else:
+                    print(f"⚠️ 记录 {record['id']} 无法解析状态: {record['barcode_data']}")
             
-            if status:
-                # 更新记录
-                update_data = {'status': status}
-                
-                update_response = requests.patch(
-                    f"{api_url}/barcode_scans?id=eq.{record_id}",
-                    headers=headers,
-                    json=update_data,
-                    timeout=10
+            # 3. 按 id 批量 upsert，每批一次请求，已存在的记录只更新 status
+            for batch in chunks(payload, UPSERT_BATCH_SIZE):
+                update_response = SESSION.post(
+                    f"{API_URL}/barcode_scans?on_conflict=id",
+                    headers={'Prefer': 'resolution=merge-duplicates,return=minimal'},
+                    data=dumps(batch),
+                    timeout=BULK_TIMEOUT
                 )
                 
-                if update_response.status_code in [200, 204]:
-                    print(f"✅ 更新记录 {record_id}: {barcode_data} -> {status}")
-                    updated_count += 1
+                if update_response.status_code in [200, 201, 204]:
+                    print(f"✅ 批量更新 {len(batch)} 条记录 (id {batch[0]['id']} - {batch[-1]['id']})")
+                    updated_count += len(batch)
                 else:
-                    print(f"❌ 更新记录 {record_id} 失败: HTTP {update_response.status_code}")
-            else:
-                print(f"⚠️ 记录 {record_id} 无法解析状态: {barcode_data}")
+                    print(f"⚠️ 批量更新 {len(batch)} 条记录失败: HTTP {update_response.status_code}，改为逐条并发更新")
+                    print(f"响应内容: {update_response.text}")
+                    updated_count += patch_statuses_concurrently(batch)
+        
+        if not found_count:
+            print("✅ 没有需要更新的记录")
+            return True
         
-        print(f"\n🎉 更新完成！成功更新了 {updated_count} 条记录")
+        print(f"\n🎉 更新完成！共检查 {found_count} 条记录，成功更新了 {updated_count} 条记录")
         return True
         
     except Exception as e: